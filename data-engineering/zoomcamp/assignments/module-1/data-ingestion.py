@@ -1,38 +1,318 @@
+import functools
+import io
+import os
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import click
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from tqdm.auto import tqdm
 import re
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import pyarrow.parquet as pq
+from ingest_metrics import IngestMetrics
 
 
-def read_parquet_in_batches(filepath, batch_size=10000):
-    """Generator to read parquet file in batches"""
+class AdaptiveBatcher:
+    """Chooses how many rows the next chunk should have.
+
+    The row count is capped by ``target_bytes`` using the bytes per row seen
+    so far, and scaled up while writes finish well under ``target_seconds``
+    and down when they take longer, so the writer stays busy without chunks
+    growing past the memory budget.
+    """
+
+    def __init__(self, target_bytes=64 * 1024 * 1024, target_seconds=2.0,
+                 initial_rows=10_000, min_rows=1_000, max_rows=2_000_000):
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.rows = initial_rows
+        self.lock = threading.Lock()
+
+    def observe(self, rows, nbytes, seconds):
+        if not rows:
+            return
+        with self.lock:
+            budget_rows = self.target_bytes / max(nbytes / rows, 1)
+            if seconds < self.target_seconds / 2:
+                factor = 1.5
+            elif seconds > self.target_seconds:
+                factor = max(self.target_seconds / seconds, 0.5)
+            else:
+                factor = 1.0
+            rows = int(self.rows * factor)
+            self.rows = max(self.min_rows, min(rows, int(budget_rows), self.max_rows))
+
+
+def rebatch(batches, batcher):
+    """Regroup record batches into batches of ``batcher.rows`` rows."""
+    pending, pending_rows = [], 0
+    for batch in batches:
+        while len(batch):
+            take = min(len(batch), batcher.rows - pending_rows)
+            pending.append(batch.slice(0, take))
+            pending_rows += take
+            batch = batch.slice(take)
+            if pending_rows >= batcher.rows:
+                yield pa.Table.from_batches(pending).combine_chunks().to_batches()[0]
+                pending, pending_rows = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending).combine_chunks().to_batches()[0]
+
+
+def read_parquet_in_batches(filepath, batch_size=10000, row_groups=None, batcher=None):
+    """Generator to read parquet file in batches (as Arrow record batches)"""
     parquet_file = pq.ParquetFile(filepath)
-    for batch in parquet_file.iter_batches(batch_size=batch_size):
-        yield batch.to_pandas()
+    batches = parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups)
+    yield from rebatch(batches, batcher) if batcher else batches
+
+
+def read_csv_in_batches(reader, batcher):
+    """Generator pulling ``batcher.rows`` rows at a time from a pandas CSV reader"""
+    with reader:
+        while True:
+            try:
+                yield reader.get_chunk(batcher.rows)
+            except StopIteration:
+                return
+
+
+def as_frame(chunk):
+    return chunk.to_pandas() if isinstance(chunk, pa.RecordBatch) else chunk
+
+
+def chunk_nbytes(chunk):
+    if isinstance(chunk, pa.RecordBatch):
+        return chunk.nbytes
+    return int(chunk.memory_usage(index=False).sum())
+
+
+def supports_copy(engine):
+    """COPY FROM STDIN is only available on PostgreSQL through psycopg2's copy_expert."""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+
+def to_csv_buffer(chunk):
+    """Serialise a chunk as header-less CSV for COPY.
+
+    Arrow record batches go through Arrow's CSV writer straight from the
+    columnar buffers, without materialising a pandas DataFrame.
+    """
+    if isinstance(chunk, pa.RecordBatch):
+        buffer = io.BytesIO()
+        pa_csv.write_csv(chunk, buffer, pa_csv.WriteOptions(include_header=False))
+        columns = chunk.schema.names
+    else:
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, index=False, header=False)
+        columns = chunk.columns
+    buffer.seek(0)
+    return buffer, ", ".join(f'"{column}"' for column in columns)
+
+
+def write_chunk(chunk, table_name, engine, use_copy, stage):
+    """Write one chunk in its own transaction, timing the convert and write stages."""
+    if use_copy:
+        with stage("convert"):
+            buffer, columns = to_csv_buffer(chunk)
+        with stage("write"), engine.begin() as conn:
+            with conn.connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+                )
+    else:
+        with stage("convert"):
+            df = as_frame(chunk)
+        with stage("write"), engine.begin() as conn:
+            df.to_sql(
+                name=table_name,
+                con=conn,
+                if_exists="append",
+                index=False,
+                method="multi",
+            )
+
+
+def run_pipeline(items, write, writers, queue_size):
+    """Produce ``items`` on a reader thread and write them with ``writers`` threads.
+
+    The bounded queue makes the reader wait when the writers fall behind. On
+    the first failure every thread winds down and the error of the earliest
+    item is raised (a reader failure counts as the item it was about to produce).
+    """
+    work = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                work.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        position = 0
+        try:
+            for position, item in enumerate(items):
+                if not put((position, item)):
+                    return
+        except Exception as e:
+            errors.append((position + 1, e))
+            stop.set()
+            return
+        for _ in range(writers):
+            put(None)
+
+    def writer():
+        while not stop.is_set():
+            try:
+                task = work.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if task is None:
+                return
+            position, item = task
+            try:
+                write(item)
+            except Exception as e:
+                errors.append((position, e))
+                stop.set()
+                return
 
+    threads = [threading.Thread(target=reader)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise min(errors, key=lambda error: error[0])[1]
 
-def create_table(iterator, filename, engine):
+
+def create_table(iterator, filename, engine, writers=0, queue_size=4, metrics_file=None,
+                 loader="copy", batcher=None):
+    """Load the chunks of ``iterator`` into a table named after ``filename``.
+
+    With the ``copy`` loader chunks are streamed with ``COPY ... FROM STDIN``
+    (Parquet record batches are serialised by Arrow, never converted to
+    pandas); otherwise, or when COPY is not available, they are inserted with
+    ``to_sql``.
+
+    With ``writers`` > 0 the chunks are read on a background thread into a
+    queue of ``queue_size`` chunks and written by ``writers`` threads, so
+    parsing and inserting overlap. Read/parse, convert and write timings per
+    chunk go to an ``IngestMetrics`` summarised at the end, and the write
+    latency is reported to ``batcher`` when the iterator is adaptive.
+    """
     pattern = r"\.[^.]+$"
     TABLE_NAME = re.sub(pattern, "", filename)
-    first = True
-    for chunk in tqdm(iterator):
-        if first:
-            chunk.head(0).to_sql(
-                name=TABLE_NAME, con=engine, if_exists="replace", index=False
-            )
-            first = False
-            print(f"Table {TABLE_NAME} Created")
-        chunk.to_sql(
-            name=TABLE_NAME,
-            con=engine,
-            if_exists="append",
-            index=False,
-            method="multi",
-        )
+    metrics = IngestMetrics(TABLE_NAME, metrics_file)
+    use_copy = loader == "copy" and supports_copy(engine)
+
+    def timed_chunks():
+        chunks = iter(tqdm(iterator))
+        for index in itertools.count():
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            stage = "read" if isinstance(chunk, pa.RecordBatch) else "parse"
+            metrics.add(index, stage, time.perf_counter() - started)
+            yield index, chunk
+
+    chunks = timed_chunks()
+    first = next(chunks, None)
+    if first is None:
+        return
+    as_frame(first[1][:0]).to_sql(
+        name=TABLE_NAME, con=engine, if_exists="replace", index=False
+    )
+    print(f"Table {TABLE_NAME} Created")
+
+    def write(item):
+        index, chunk = item
+        started = time.perf_counter()
+        write_chunk(chunk, TABLE_NAME, engine, use_copy, functools.partial(metrics.stage, index))
+        elapsed = time.perf_counter() - started
+        nbytes = chunk_nbytes(chunk)
+        metrics.done(index, len(chunk), nbytes)
+        if batcher:
+            batcher.observe(len(chunk), nbytes, elapsed)
         print("Inserted:", len(chunk))
 
+    chunks = itertools.chain([first], chunks)
+    if writers:
+        run_pipeline(chunks, write, writers, queue_size)
+    else:
+        for item in chunks:
+            write(item)
+    metrics.summary()
+
+
+def create_table_by_row_groups(filepath, engine, workers, batch_size=10000, metrics_file=None,
+                               loader="copy", batcher=None):
+    """Load a Parquet file with ``workers`` threads, each owning a share of its row groups.
+
+    Every worker decodes its row groups and writes them over its own pooled
+    connection. At the end the rows written and the rows in the table are
+    checked against the row count in the Parquet metadata.
+    """
+    TABLE_NAME = re.sub(r"\.[^.]+$", "", os.path.basename(filepath))
+    metrics = IngestMetrics(TABLE_NAME, metrics_file)
+    use_copy = loader == "copy" and supports_copy(engine)
+    parquet_file = pq.ParquetFile(filepath)
+    expected_rows = parquet_file.metadata.num_rows
+    num_row_groups = parquet_file.metadata.num_row_groups
+
+    parquet_file.schema_arrow.empty_table().to_pandas().to_sql(
+        name=TABLE_NAME, con=engine, if_exists="replace", index=False
+    )
+    print(f"Table {TABLE_NAME} Created ({num_row_groups} row groups, {expected_rows} rows)")
+
+    def load_row_groups(row_groups):
+        rows = 0
+        for row_group in row_groups:
+            batches = read_parquet_in_batches(filepath, batch_size, [row_group], batcher)
+            for batch_index in itertools.count():
+                unit = f"rg{row_group}.{batch_index}"
+                started = time.perf_counter()
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                metrics.add(unit, "read", time.perf_counter() - started)
+                started = time.perf_counter()
+                write_chunk(batch, TABLE_NAME, engine, use_copy, functools.partial(metrics.stage, unit))
+                metrics.done(unit, len(batch), batch.nbytes)
+                if batcher:
+                    batcher.observe(len(batch), batch.nbytes, time.perf_counter() - started)
+                rows += len(batch)
+            print(f"Row group {row_group} loaded")
+        return rows
+
+    workers = max(1, min(workers, num_row_groups))
+    assignments = [list(range(worker, num_row_groups, workers)) for worker in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        written_rows = sum(executor.map(load_row_groups, assignments))
+
+    with engine.connect() as conn:
+        table_rows = conn.execute(text(f'SELECT COUNT(*) FROM "{TABLE_NAME}"')).scalar()
+    metrics.summary()
+    if not written_rows == table_rows == expected_rows:
+        raise RuntimeError(
+            f"{TABLE_NAME}: Parquet metadata has {expected_rows} rows, "
+            f"wrote {written_rows}, table has {table_rows}"
+        )
+    print(f"Row counts match Parquet metadata: {expected_rows}")
+
 
 @click.command()
 @click.option("--user", default="root", help="PostgreSQL user")
@@ -40,10 +320,27 @@ def create_table(iterator, filename, engine):
 @click.option("--host", default="localhost", help="PostgreSQL host")
 @click.option("--port", default=9868, type=int, help="PostgreSQL port")
 @click.option("--db", default="ny_taxi", help="PostgreSQL database name")
-def ingest_data(user, password, host, port, db):
+@click.option("--writers", type=click.IntRange(min=0), default=0,
+              help="Writer threads fed by a background reader thread (0 = read and write serially)")
+@click.option("--queue-size", type=click.IntRange(min=1), default=4, help="Chunks buffered between reader and writers")
+@click.option("--metrics-file", default=None, help="Append per-chunk timings as JSON lines to this file")
+@click.option("--loader", type=click.Choice(["copy", "insert"]), default="copy",
+              help="copy streams chunks with COPY FROM STDIN, insert uses multi-row INSERTs")
+@click.option("--row-group-workers", type=click.IntRange(min=0), default=0,
+              help="Load the trips Parquet file with this many threads, split by row group (0 = off)")
+@click.option("--adaptive-batches/--fixed-batches", default=False,
+              help="Size batches from a byte budget and the measured write latency")
+@click.option("--batch-mb", type=click.IntRange(min=1), default=64, help="Memory budget per batch with --adaptive-batches")
+@click.option("--target-write-seconds", type=float, default=2.0,
+              help="Write latency per batch that --adaptive-batches aims for")
+def ingest_data(user, password, host, port, db, writers, queue_size, metrics_file, loader,
+                row_group_workers, adaptive_batches, batch_mb, target_write_seconds):
     FILENM_TAXI_TRIPS = "green_tripdata_2025-11.parquet"
     FILENM_TAXI_ZONES = "taxi_zone_lookup.csv"
-    engine = create_engine(f"postgresql://{user}:{password}@{host}:{port}/{db}")
+    engine = create_engine(
+        f"postgresql://{user}:{password}@{host}:{port}/{db}",
+        pool_size=max(writers, row_group_workers) + 1,
+    )
 
     csv_dtype = {
         "LocationID": "Int64",
@@ -52,14 +349,36 @@ def ingest_data(user, password, host, port, db):
         "service_zone": "string",
     }
 
-    csv_iter = pd.read_csv(
-        FILENM_TAXI_ZONES, iterator=True, chunksize=10000, dtype=csv_dtype
-    )
+    trips_batcher = zones_batcher = None
+    if adaptive_batches:
+        trips_batcher = AdaptiveBatcher(batch_mb * 1024 * 1024, target_write_seconds)
+        zones_batcher = AdaptiveBatcher(batch_mb * 1024 * 1024, target_write_seconds)
+        csv_iter = read_csv_in_batches(
+            pd.read_csv(FILENM_TAXI_ZONES, iterator=True, dtype=csv_dtype), zones_batcher
+        )
+    else:
+        csv_iter = pd.read_csv(
+            FILENM_TAXI_ZONES, iterator=True, chunksize=10000, dtype=csv_dtype
+        )
 
-    parquet_iter = read_parquet_in_batches(FILENM_TAXI_TRIPS, batch_size=10000)
+    parquet_iter = read_parquet_in_batches(FILENM_TAXI_TRIPS, batch_size=10000, batcher=trips_batcher)
 
-    create_table(parquet_iter, FILENM_TAXI_TRIPS, engine)
-    create_table(csv_iter, FILENM_TAXI_ZONES, engine)
+    if loader == "copy" and not supports_copy(engine):
+        print("COPY not available for this connection, falling back to INSERT")
+        loader = "insert"
+    if row_group_workers:
+        create_table_by_row_groups(
+            FILENM_TAXI_TRIPS, engine, row_group_workers, metrics_file=metrics_file, loader=loader,
+            batcher=trips_batcher,
+        )
+    else:
+        create_table(
+            parquet_iter, FILENM_TAXI_TRIPS, engine, writers, queue_size, metrics_file, loader,
+            trips_batcher,
+        )
+    create_table(
+        csv_iter, FILENM_TAXI_ZONES, engine, writers, queue_size, metrics_file, loader, zones_batcher
+    )
 
 
 if __name__ == "__main__":
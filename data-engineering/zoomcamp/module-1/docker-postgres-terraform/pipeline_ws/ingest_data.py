@@ -1,7 +1,18 @@
+import contextlib
+import functools
+import io
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import click
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from tqdm.auto import tqdm
+from ingest_metrics import IngestMetrics
 
 # user="root",
 # password="root",
@@ -13,6 +24,507 @@ from tqdm.auto import tqdm
 # month=1
 
 chunk_size = 100_000
+arrow_block_size = 16 * 1024 * 1024
+checkpoint_table = "ingest_checkpoints"
+
+dtype = {
+    "VendorID": "Int64",
+    "passenger_count": "Int64",
+    "trip_distance": "float64",
+    "RatecodeID": "Int64",
+    "store_and_fwd_flag": "string",
+    "PULocationID": "Int64",
+    "DOLocationID": "Int64",
+    "payment_type": "Int64",
+    "fare_amount": "float64",
+    "extra": "float64",
+    "mta_tax": "float64",
+    "tip_amount": "float64",
+    "tolls_amount": "float64",
+    "improvement_surcharge": "float64",
+    "total_amount": "float64",
+    "congestion_surcharge": "float64",
+}
+parse_dates = ["tpep_pickup_datetime", "tpep_dropoff_datetime"]
+arrow_types = {"Int64": pa.int64(), "float64": pa.float64(), "string": pa.string()}
+postgres_types = {"Int64": "BIGINT", "float64": "DOUBLE PRECISION", "string": "TEXT"}
+
+
+def supports_copy(engine):
+    """COPY FROM STDIN is only available on PostgreSQL through psycopg2's copy_expert."""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+
+def as_frame(chunk):
+    """Chunks are DataFrames or, with the pyarrow engine, Arrow record batches."""
+    return chunk.to_pandas() if isinstance(chunk, pa.RecordBatch) else chunk
+
+
+def chunk_nbytes(chunk):
+    if isinstance(chunk, pa.RecordBatch):
+        return chunk.nbytes
+    return int(chunk.memory_usage(index=False).sum())
+
+
+def no_stage(name):
+    return contextlib.nullcontext()
+
+
+def copy_chunk(df_chunk, table_name, conn, stage=no_stage):
+    """Stream a chunk into the table with COPY ... FROM STDIN (CSV format)."""
+    with stage("convert"):
+        if isinstance(df_chunk, pa.RecordBatch):
+            buffer = io.BytesIO()
+            pa_csv.write_csv(df_chunk, buffer, pa_csv.WriteOptions(include_header=False))
+            columns = ", ".join(f'"{column}"' for column in df_chunk.schema.names)
+        else:
+            buffer = io.StringIO()
+            df_chunk.to_csv(buffer, index=False, header=False)
+            columns = ", ".join(f'"{column}"' for column in df_chunk.columns)
+        buffer.seek(0)
+    with stage("write"), conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+
+
+def insert_chunk(df_chunk, table_name, conn, stage=no_stage):
+    with stage("convert"):
+        df_chunk = as_frame(df_chunk)
+    with stage("write"):
+        df_chunk.to_sql(
+            name=table_name,
+            con=conn,
+            if_exists="append",
+            index=False,
+            chunksize=chunk_size,
+            method="multi",
+        )
+
+
+class AdaptiveBatcher:
+    """Chooses how many rows the next chunk should have.
+
+    The row count is capped by ``target_bytes`` using the bytes per row seen
+    so far, and scaled up while writes finish well under ``target_seconds``
+    and down when they take longer, so the writer stays busy without chunks
+    growing past the memory budget.
+    """
+
+    def __init__(self, target_bytes=64 * 1024 * 1024, target_seconds=2.0,
+                 initial_rows=10_000, min_rows=1_000, max_rows=2_000_000):
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.rows = initial_rows
+        self.lock = threading.Lock()
+
+    def observe(self, rows, nbytes, seconds):
+        if not rows:
+            return
+        with self.lock:
+            budget_rows = self.target_bytes / max(nbytes / rows, 1)
+            if seconds < self.target_seconds / 2:
+                factor = 1.5
+            elif seconds > self.target_seconds:
+                factor = max(self.target_seconds / seconds, 0.5)
+            else:
+                factor = 1.0
+            rows = int(self.rows * factor)
+            self.rows = max(self.min_rows, min(rows, int(budget_rows), self.max_rows))
+
+
+def rebatch(batches, batcher):
+    """Regroup record batches into batches of ``batcher.rows`` rows."""
+    pending, pending_rows = [], 0
+    for batch in batches:
+        while len(batch):
+            take = min(len(batch), batcher.rows - pending_rows)
+            pending.append(batch.slice(0, take))
+            pending_rows += take
+            batch = batch.slice(take)
+            if pending_rows >= batcher.rows:
+                yield pa.Table.from_batches(pending).combine_chunks().to_batches()[0]
+                pending, pending_rows = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending).combine_chunks().to_batches()[0]
+
+
+def read_pandas_chunks(file_name, rows_loaded=0, batcher=None):
+    read_options = {}
+    if rows_loaded:
+        # Skip the committed rows in the C parser rather than parsing them again
+        columns = pd.read_csv(file_name, nrows=0).columns
+        read_options = {"skiprows": rows_loaded + 1, "header": None, "names": columns}
+    reader = pd.read_csv(
+        file_name,
+        dtype=dtype,
+        parse_dates=parse_dates,
+        iterator=True,
+        chunksize=None if batcher else chunk_size,
+        **read_options,
+    )
+    if batcher is None:
+        return reader
+    return adaptive_pandas_chunks(reader, batcher)
+
+
+def adaptive_pandas_chunks(reader, batcher):
+    with reader:
+        while True:
+            try:
+                yield reader.get_chunk(batcher.rows)
+            except StopIteration:
+                return
+
+
+def read_arrow_chunks(file_name, rows_loaded=0, batcher=None):
+    """Yield record batches parsed by Arrow's multi-threaded streaming CSV reader.
+
+    ``dtype`` and ``parse_dates`` are translated into Arrow types. Integer
+    columns are parsed as float64 because the TLC files write them as ``1.0``,
+    and every batch is cast back to int64 (failing on fractional values).
+    With a ``batcher`` the batches are regrouped to its current row count.
+    """
+    read_types = {column: pa.timestamp("s") for column in parse_dates}
+    target_types = dict(read_types)
+    for column, pandas_type in dtype.items():
+        target_types[column] = arrow_types[pandas_type]
+        read_types[column] = pa.float64() if pandas_type == "Int64" else arrow_types[pandas_type]
+
+    reader = pa_csv.open_csv(
+        file_name,
+        read_options=pa_csv.ReadOptions(
+            block_size=arrow_block_size, skip_rows_after_names=rows_loaded
+        ),
+        convert_options=pa_csv.ConvertOptions(column_types=read_types),
+    )
+    schema = pa.schema(
+        [pa.field(field.name, target_types.get(field.name, field.type)) for field in reader.schema]
+    )
+    batches = (batch.cast(schema) for batch in reader)
+    yield from rebatch(batches, batcher) if batcher else batches
+
+
+def ensure_checkpoint_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {checkpoint_table} ("
+            "table_name TEXT PRIMARY KEY, "
+            "chunk_index INTEGER NOT NULL, "
+            "rows_loaded BIGINT NOT NULL, "
+            "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+
+
+def read_checkpoint(conn, table_name):
+    """Return ``(chunk_index, rows_loaded)`` of the last committed chunk, or None."""
+    row = conn.execute(
+        text(f"SELECT chunk_index, rows_loaded FROM {checkpoint_table} WHERE table_name = :table_name"),
+        {"table_name": table_name},
+    ).first()
+    return tuple(row) if row else None
+
+
+def save_checkpoint(conn, table_name, chunk_index, rows_loaded):
+    conn.execute(
+        text(
+            f"INSERT INTO {checkpoint_table} (table_name, chunk_index, rows_loaded, updated_at) "
+            "VALUES (:table_name, :chunk_index, :rows_loaded, CURRENT_TIMESTAMP) "
+            "ON CONFLICT (table_name) DO UPDATE SET chunk_index = excluded.chunk_index, "
+            "rows_loaded = excluded.rows_loaded, updated_at = excluded.updated_at"
+        ),
+        {"table_name": table_name, "chunk_index": chunk_index, "rows_loaded": rows_loaded},
+    )
+
+
+def clear_checkpoint(conn, table_name):
+    conn.execute(
+        text(f"DELETE FROM {checkpoint_table} WHERE table_name = :table_name"),
+        {"table_name": table_name},
+    )
+
+
+def table_has_rows(engine, table_name):
+    if not inspect(engine).has_table(table_name):
+        return False
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT 1 FROM "{table_name}" LIMIT 1')).first() is not None
+
+
+def create_staging_table(conn, staging_name, columns):
+    """Create an UNLOGGED table with column types taken from ``dtype``/``parse_dates``."""
+    column_types = {column: "TIMESTAMP" for column in parse_dates}
+    column_types.update({column: postgres_types[kind] for column, kind in dtype.items()})
+    ddl = ", ".join(f'"{column}" {column_types.get(column, "TEXT")}' for column in columns)
+    conn.execute(text(f'DROP TABLE IF EXISTS "{staging_name}"'))
+    conn.execute(text(f'CREATE UNLOGGED TABLE "{staging_name}" ({ddl})'))
+
+
+def swap_in_staging(engine, staging_name, table_name, index_columns):
+    """Index the loaded staging table, make it LOGGED and rename it over the target."""
+    with engine.begin() as conn:
+        for column in index_columns:
+            print(f"Creating index on {column}")
+            conn.execute(text(
+                f'CREATE INDEX "{staging_name}_{column}_idx" ON "{staging_name}" ("{column}")'
+            ))
+        conn.execute(text(f'ALTER TABLE "{staging_name}" SET LOGGED'))
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+        conn.execute(text(f'ALTER TABLE "{staging_name}" RENAME TO "{table_name}"'))
+        for column in index_columns:
+            conn.execute(text(
+                f'ALTER INDEX "{staging_name}_{column}_idx" RENAME TO "{table_name}_{column}_idx"'
+            ))
+        clear_checkpoint(conn, staging_name)
+    with engine.connect() as conn:
+        conn.execute(text(f'ANALYZE "{table_name}"'))
+        conn.commit()
+    print(f"Swapped {staging_name} in as {table_name}")
+
+
+class ChunkAbandoned(Exception):
+    """Raised to a writer whose chunk can no longer commit because another one failed."""
+
+
+class CommitOrder:
+    """Lets concurrent writers commit their chunks strictly in chunk order.
+
+    Checkpoints record the last committed chunk, so a chunk may only commit
+    once every chunk before it has.
+    """
+
+    def __init__(self, next_index, stop):
+        self.next_index = next_index
+        self.stop = stop
+        self.condition = threading.Condition()
+
+    def wait(self, index):
+        with self.condition:
+            while self.next_index != index:
+                if self.stop.is_set():
+                    raise ChunkAbandoned(f"chunk {index} abandoned after an earlier failure")
+                self.condition.wait(timeout=0.5)
+
+    def advance(self):
+        with self.condition:
+            self.next_index += 1
+            self.condition.notify_all()
+
+
+def run_pipeline(items, write, writers, queue_size, stop):
+    """Produce ``items`` on a reader thread and consume them with ``writers`` threads.
+
+    The bounded queue makes the reader wait when the writers fall behind. On
+    the first failure ``stop`` is set, every thread winds down, and the error
+    of the earliest item is raised (a reader failure counts as the item it
+    was about to produce).
+    """
+    work = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                work.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        position = 0
+        try:
+            for position, item in enumerate(items):
+                if not put((position, item)):
+                    return
+        except Exception as e:
+            errors.append((position + 1, e))
+            stop.set()
+            return
+        for _ in range(writers):
+            put(None)
+
+    def writer():
+        while not stop.is_set():
+            try:
+                task = work.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if task is None:
+                return
+            position, item = task
+            try:
+                write(*item)
+            except ChunkAbandoned:
+                # A consequence of the failure that set stop, not a cause; that one is reported
+                return
+            except Exception as e:
+                errors.append((position, e))
+                stop.set()
+                return
+
+    threads = [threading.Thread(target=reader)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise min(errors, key=lambda error: error[0])[1]
+
+
+def parse_months(value):
+    """Expand a ``YYYY-MM..YYYY-MM`` range (or a single ``YYYY-MM``) into (year, month) pairs."""
+    first, _, last = value.partition("..")
+    try:
+        start = pd.Period(first, freq="M")
+        end = pd.Period(last or first, freq="M")
+    except ValueError as e:
+        # pandas' DateParseError, e.g. for 2021-13 or a typo
+        raise click.BadParameter(f"{value} is not a YYYY-MM month or YYYY-MM..YYYY-MM range ({e})",
+                                 param_hint="--months") from e
+    if start is pd.NaT or end is pd.NaT:
+        raise click.BadParameter(f"{value} is missing a month", param_hint="--months")
+    if end < start:
+        raise click.BadParameter(f"range {value} ends before it starts", param_hint="--months")
+    return [(period.year, period.month) for period in pd.period_range(start, end, freq="M")]
+
+
+def load_month(url, table, year, month, loader, resume=True, progress=True, csv_engine="pandas",
+               staging=False, index_columns=(), writers=0, queue_size=4, metrics_file=None,
+               batcher_options=None):
+    """Load one ``yellow_tripdata_YYYY-MM.csv.gz`` file into ``{table}_{year}_{month}``.
+
+    Every chunk is committed in its own transaction together with its
+    checkpoint row, so with ``resume`` an interrupted load continues after the
+    last committed chunk instead of recreating the table.
+
+    With ``staging`` the rows go into an UNLOGGED ``{table_name}_staging``
+    table created from ``dtype``; once loaded it gets ``index_columns``
+    indexed, is set LOGGED and renamed over the target table.
+
+    With ``writers`` > 0 a reader thread parses chunks into a queue of
+    ``queue_size`` chunks that ``writers`` threads drain over pooled
+    connections; commits still happen in chunk order.
+
+    Parse, convert and write timings of every chunk are collected in an
+    ``IngestMetrics`` (written as JSON lines to ``metrics_file`` if given)
+    and summarised at the end.
+
+    With ``batcher_options`` (``AdaptiveBatcher`` arguments) the chunk size
+    is no longer fixed: each write reports its latency and the batcher sizes
+    the following chunks.
+
+    Returns a ``(table_name, rows, seconds)`` tuple. Each call creates its own
+    engine, so it is safe to run in a separate process.
+    """
+    start = time.perf_counter()
+    file_name = f"yellow_tripdata_{year}-{month:02d}.csv.gz"
+    engine = create_engine(url, pool_size=writers + 1)
+    table_name = f'{table}_{year}_{month:02d}'
+    write_table = f"{table_name}_staging" if staging else table_name
+    if loader == "copy" and not supports_copy(engine):
+        print("COPY not available for this connection, falling back to INSERT")
+        loader = "insert"
+    write_chunk = copy_chunk if loader == "copy" else insert_chunk
+    metrics = IngestMetrics(table_name, metrics_file)
+    batcher = AdaptiveBatcher(**batcher_options) if batcher_options else None
+
+    checkpoint = None
+    if resume:
+        with engine.connect() as conn:
+            checkpoint = read_checkpoint(conn, write_table)
+        # An UNLOGGED staging table comes back empty after a server crash
+        if checkpoint and not table_has_rows(engine, write_table):
+            checkpoint = None
+    chunk_index, rows_loaded = checkpoint if checkpoint else (-1, 0)
+
+    if rows_loaded:
+        print(f"Resuming {write_table} after chunk {chunk_index} ({rows_loaded} rows)")
+    read_chunks = read_arrow_chunks if csv_engine == "pyarrow" else read_pandas_chunks
+
+    def numbered_chunks():
+        index, offset = chunk_index, rows_loaded
+        chunks = iter(tqdm(
+            read_chunks(file_name, rows_loaded, batcher), desc=table_name, disable=not progress
+        ))
+        while True:
+            started = time.perf_counter()
+            df_chunk = next(chunks, None)
+            if df_chunk is None:
+                return
+            if len(df_chunk) == 0:
+                continue
+            index += 1
+            offset += len(df_chunk)
+            metrics.add(index, "parse", time.perf_counter() - started)
+            yield index, offset, df_chunk
+
+    items = numbered_chunks()
+    if checkpoint is None:
+        first = next(items, None)
+        if first is None:
+            engine.dispose()
+            return table_name, 0, time.perf_counter() - start
+        with engine.begin() as conn:
+            clear_checkpoint(conn, write_table)
+            empty = as_frame(first[2][:0])
+            if staging:
+                create_staging_table(conn, write_table, empty.columns)
+            else:
+                empty.to_sql(name=write_table, con=conn, if_exists="replace", index=False)
+        print("Table created")
+        items = itertools.chain([first], items)
+
+    stop = threading.Event()
+    order = CommitOrder(chunk_index + 1, stop)
+    committed = [rows_loaded]
+
+    def write(index, offset, df_chunk):
+        stage = functools.partial(metrics.stage, index)
+        with engine.connect() as conn:
+            # Begun explicitly so to_sql joins it instead of committing on its own;
+            # the chunk and its checkpoint commit together or not at all
+            transaction = conn.begin()
+            started = time.perf_counter()
+            write_chunk(df_chunk, write_table, conn, stage)
+            elapsed = time.perf_counter() - started
+            order.wait(index)
+            started = time.perf_counter()
+            with stage("write"):
+                save_checkpoint(conn, write_table, index, offset)
+                transaction.commit()
+            elapsed += time.perf_counter() - started
+        committed[0] = offset
+        order.advance()
+        nbytes = chunk_nbytes(df_chunk)
+        metrics.done(index, len(df_chunk), nbytes)
+        if batcher:
+            batcher.observe(len(df_chunk), nbytes, elapsed)
+        print("Inserted:", len(df_chunk))
+
+    if writers:
+        run_pipeline(items, write, writers, queue_size, stop)
+    else:
+        for item in items:
+            write(*item)
+    if staging:
+        swap_in_staging(engine, write_table, table_name, index_columns)
+    engine.dispose()
+    metrics.summary()
+    return table_name, committed[0] - rows_loaded, time.perf_counter() - start
+
+
+def print_summary(results):
+    print(f"{'table':<32}{'rows':>12}{'seconds':>10}{'rows/s':>12}")
+    for table_name, rows, seconds in results:
+        print(f"{table_name:<32}{rows:>12,}{seconds:>10.1f}{rows / seconds:>12,.0f}")
+    total_rows = sum(rows for _, rows, _ in results)
+    print(f"{'total':<32}{total_rows:>12,}")
+
 
 @click.command()
 @click.option('--user', default='root', help='PostgreSQL user')
@@ -23,13 +535,66 @@ chunk_size = 100_000
 @click.option('--table', default='yellow_taxi_data', help='Target table name')
 @click.option('--year', type=int, default=2021, help='Year of the data to ingest')
 @click.option('--month', type=int, default=1, help='Month of the data to ingest (1-12)')
+@click.option('--months', default=None,
+              help='Range of months to ingest in parallel, e.g. 2021-01..2021-12 (overrides --year/--month)')
+@click.option('--workers', type=click.IntRange(min=1), default=4, help='Worker processes used with --months')
+@click.option('--loader', type=click.Choice(['copy', 'insert']), default='copy',
+              help='copy streams chunks with COPY FROM STDIN, insert uses multi-row INSERTs')
+@click.option('--resume/--no-resume', default=True,
+              help='Continue after the last checkpointed chunk instead of reloading the table')
+@click.option('--csv-engine', type=click.Choice(['pandas', 'pyarrow']), default='pandas',
+              help='pyarrow parses the CSV into Arrow record batches with multiple threads')
+@click.option('--staging/--no-staging', default=False,
+              help='Load into an UNLOGGED staging table, index it and swap it in at the end')
+@click.option('--index', 'index_columns', multiple=True,
+              default=['tpep_pickup_datetime', 'PULocationID'],
+              help='Column to index after a --staging load (repeatable)')
+@click.option('--writers', type=click.IntRange(min=0), default=0,
+              help='Writer threads fed by a background reader thread (0 = read and write serially)')
+@click.option('--queue-size', type=click.IntRange(min=1), default=4, help='Parsed chunks buffered between reader and writers')
+@click.option('--metrics-file', default=None, help='Append per-chunk timings as JSON lines to this file')
+@click.option('--adaptive-batches/--fixed-batches', default=False,
+              help='Size chunks from a byte budget and the measured write latency')
+@click.option('--batch-mb', type=click.IntRange(min=1), default=64, help='Memory budget per chunk with --adaptive-batches')
+@click.option('--target-write-seconds', type=float, default=2.0,
+              help='Write latency per chunk that --adaptive-batches aims for')
 
-def ingest_data(user, password, host, port, db, table, year, month):
+def ingest_data(user, password, host, port, db, table, year, month, months, workers, loader, resume,
+                csv_engine, staging, index_columns, writers, queue_size, metrics_file,
+                adaptive_batches, batch_mb, target_write_seconds):
     """Ingests NYC Yellow Taxi data into a PostgreSQL database.
 
     The function reads a compressed CSV file containing New York taxi ride data
     for a given year and month, and loads it into a PostgreSQL table
-    using chunked inserts to reduce memory usage.
+    using chunked writes to reduce memory usage. With the ``copy`` loader each
+    chunk is streamed through ``COPY ... FROM STDIN``; when COPY is not available
+    (non-PostgreSQL engine or driver) it falls back to multi-row INSERTs.
+
+    With ``--months`` every month in the range is loaded into its own table by
+    a pool of worker processes, each with its own database connection, and a
+    rows/sec summary per month is printed at the end.
+
+    With ``--csv-engine pyarrow`` the file is parsed by Arrow's streaming CSV
+    reader and record batches are written without converting them to pandas
+    (the ``copy`` loader serialises them with Arrow's CSV writer).
+
+    With ``--staging`` the month is bulk-loaded into an UNLOGGED table with
+    explicit column types, then the ``--index`` columns are indexed, the table
+    is set LOGGED and renamed over the target in one transaction.
+
+    With ``--writers N`` parsing and writing overlap: a reader thread fills a
+    bounded queue of ``--queue-size`` chunks and N writer threads drain it
+    over pooled connections, committing in chunk order.
+
+    Per-chunk parse/convert/write timings, rows/sec, bytes/sec and peak RSS
+    are summarised at the end and, with ``--metrics-file``, written as JSON lines.
+
+    With ``--adaptive-batches`` the fixed 100k-row chunks are replaced by
+    chunks sized to ``--batch-mb`` of memory and grown or shrunk so that each
+    write takes about ``--target-write-seconds``.
+
+    Progress is checkpointed per chunk in the ``ingest_checkpoints`` table;
+    a rerun skips the chunks already committed unless ``--no-resume`` is given.
 
     Args:
     user (str): PostgreSQL username.
@@ -40,58 +605,58 @@ def ingest_data(user, password, host, port, db, table, year, month):
     table (str): Destination table name.
     year (int): Year of data to import.
     month (int): Month of data to import (1–12).
+    months (str): Optional ``YYYY-MM..YYYY-MM`` range of months to import.
+    workers (int): Number of worker processes used with ``months``.
+    loader (str): ``copy`` or ``insert``.
+    resume (bool): Resume from the last checkpoint if there is one.
+    csv_engine (str): ``pandas`` or ``pyarrow`` CSV reader.
+    staging (bool): Load through an UNLOGGED staging table and swap it in.
+    index_columns (tuple): Columns indexed after a staging load.
+    writers (int): Writer threads of the pipelined mode (0 disables it).
+    queue_size (int): Maximum number of parsed chunks waiting for a writer.
+    metrics_file (str): Optional JSON lines file for per-chunk metrics.
+    adaptive_batches (bool): Size chunks adaptively instead of using ``chunk_size``.
+    batch_mb (int): Memory budget per adaptive chunk, in MB.
+    target_write_seconds (float): Write latency the adaptive chunks aim for.
 
     Raises:
     FileNotFoundError: If the CSV file does not exist.
     sqlalchemy.exc.SQLAlchemyError: In case of connection or database write errors.
     """
+    # Bad --months input should fail before anything touches the database
+    periods = parse_months(months) if months is not None else None
+    url = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+    engine = create_engine(url)
+    if staging and engine.dialect.name != "postgresql":
+        raise click.UsageError("--staging needs a PostgreSQL database")
+    ensure_checkpoint_table(engine)
+    engine.dispose()
+    options = {
+        "csv_engine": csv_engine,
+        "staging": staging,
+        "index_columns": index_columns,
+        "writers": writers,
+        "queue_size": queue_size,
+        "metrics_file": metrics_file,
+    }
 
+    if adaptive_batches:
+        options["batcher_options"] = {
+            "target_bytes": batch_mb * 1024 * 1024,
+            "target_seconds": target_write_seconds,
+        }
 
-    file_name = f"yellow_tripdata_{year}-{month:02d}.csv.gz"
-    engine = create_engine(f"postgresql://{user}:{password}@{host}:{port}/{db}")
-    dtype = {
-        "VendorID": "Int64",
-        "passenger_count": "Int64",
-        "trip_distance": "float64",
-        "RatecodeID": "Int64",
-        "store_and_fwd_flag": "string",
-        "PULocationID": "Int64",
-        "DOLocationID": "Int64",
-        "payment_type": "Int64",
-        "fare_amount": "float64",
-        "extra": "float64",
-        "mta_tax": "float64",
-        "tip_amount": "float64",
-        "tolls_amount": "float64",
-        "improvement_surcharge": "float64",
-        "total_amount": "float64",
-        "congestion_surcharge": "float64",
-    }
-    parse_dates = ["tpep_pickup_datetime", "tpep_dropoff_datetime"]
-    df_iter = pd.read_csv(
-        file_name,
-        dtype=dtype,
-        parse_dates=parse_dates,
-        iterator=True,
-        chunksize=chunk_size,
-    )
-    first = True
-    for df_chunk in tqdm(df_iter):
-        if first:
-            df_chunk.head(0).to_sql(
-                name=f'{table}_{year}_{month:02d}', con=engine, if_exists="replace", index=False
-            )
-            first = False
-            print("Table created")
-        df_chunk.to_sql(
-            name=f'{table}_{year}_{month:02d}',
-            con=engine,
-            if_exists="append",
-            index=False,
-            chunksize=chunk_size,
-            method="multi",
-        )
-        print("Inserted:", len(df_chunk))
+    if periods is None:
+        print_summary([load_month(url, table, year, month, loader, resume, **options)])
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(periods))) as executor:
+        futures = [
+            executor.submit(load_month, url, table, y, m, loader, resume, progress=False, **options)
+            for y, m in periods
+        ]
+        results = [future.result() for future in futures]
+    print_summary(results)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+"""Throughput instrumentation shared by the ingestion scripts.
+
+Work is tracked per unit (a chunk, or a whole file for the GCS loaders).
+Each stage of a unit (read, parse, convert, write, download, upload, ...)
+is timed with ``stage()``; ``done()`` closes the unit with its row and byte
+counts, and appends it as a JSON line when a path was given. ``summary()``
+prints where the time went for the whole run.
+"""
+import json
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class IngestMetrics:
+    def __init__(self, name, jsonl_path=None):
+        self.name = name
+        self.jsonl_path = jsonl_path
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.pending = defaultdict(lambda: defaultdict(float))
+        self.stage_totals = defaultdict(float)
+        self.units = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, unit, stage, seconds):
+        with self.lock:
+            self.pending[unit][stage] += seconds
+            self.stage_totals[stage] += seconds
+
+    @contextmanager
+    def stage(self, unit, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(unit, stage, time.perf_counter() - start)
+
+    def done(self, unit, rows=0, nbytes=0):
+        """Close ``unit`` and return its record (stage timings, rates and peak RSS)."""
+        with self.lock:
+            stages = self.pending.pop(unit, {})
+            self.units += 1
+            self.rows += rows
+            self.bytes += nbytes
+        seconds = sum(stages.values())
+        record = {
+            "name": self.name,
+            "unit": unit,
+            "rows": rows,
+            "bytes": nbytes,
+            "stages": {stage: round(elapsed, 4) for stage, elapsed in stages.items()},
+            "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+            "bytes_per_sec": round(nbytes / seconds, 1) if seconds else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        if self.jsonl_path:
+            with self.lock, open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        busy = sum(self.stage_totals.values()) or 1
+        print(f"--- {self.name}: {self.units} units in {elapsed:.1f}s")
+        print(f"{'stage':<12}{'seconds':>10}{'share':>8}")
+        for stage, seconds in self.stage_totals.items():
+            print(f"{stage:<12}{seconds:>10.1f}{seconds / busy:>8.0%}")
+        print(
+            f"rows: {self.rows:,} ({self.rows / elapsed:,.0f}/s), "
+            f"bytes: {self.bytes / 1e6:,.1f} MB ({self.bytes / 1e6 / elapsed:,.1f} MB/s), "
+            f"peak RSS: {peak_rss_mb():,.0f} MB"
+        )
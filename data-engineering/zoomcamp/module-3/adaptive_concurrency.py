@@ -0,0 +1,87 @@
+"""Adaptive concurrency and retry pacing for the loaders' network stages.
+
+Each stage (download, upload) gets an AIMDLimiter that starts at a few
+concurrent requests and finds the level the network and the service
+tolerate. Failed requests are retried after backoff_delay(), which spreads
+the retries of many workers instead of having them fire together.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_WORKERS = 32
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AIMDLimiter:
+    """Concurrency limit for one stage, tuned by additive increase / multiplicative decrease.
+
+    Every healthy request raises the limit by 1/limit, i.e. about one extra
+    slot per round of requests. A request is healthy when it succeeds and its
+    seconds per MB stay within ``slowdown`` times the best seen so far. A
+    throttled request (429/5xx) halves the limit, at most once per
+    ``cooldown`` seconds, because the requests already in flight will report
+    the same congestion.
+    """
+
+    def __init__(self, name, initial=4, minimum=1, maximum=MAX_WORKERS, slowdown=2.0, cooldown=5.0):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slowdown = slowdown
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.best = None
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify_all()
+
+    def success(self, seconds, nbytes):
+        seconds_per_mb = seconds / max(nbytes / 1e6, 1.0)
+        with self.cond:
+            if self.best is None or seconds_per_mb < self.best:
+                self.best = seconds_per_mb
+            if seconds_per_mb <= self.best * self.slowdown:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.cond.notify_all()
+
+    def throttled(self):
+        with self.cond:
+            now = time.monotonic()
+            if now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.last_decrease = now
+                print(f"{self.name}: throttled, concurrency -> {int(self.limit)}")
+
+
+def http_status(exc):
+    # urllib's HTTPError and google.api_core errors carry .code; resumable-media errors carry .response
+    status = getattr(exc, "code", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_throttled(exc):
+    return http_status(exc) in THROTTLE_STATUSES
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter, so retrying workers do not fire together."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
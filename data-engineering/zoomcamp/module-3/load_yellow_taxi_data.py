@@ -1,43 +1,99 @@
+import argparse
 import os
+import queue
+import shutil
 import sys
+import threading
 import urllib.request
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from google.cloud import storage
 from google.api_core.exceptions import NotFound, Forbidden
 import time
+from adaptive_concurrency import MAX_WORKERS, AIMDLimiter, backoff_delay, http_status, is_throttled
+from ingest_metrics import IngestMetrics
+import range_download
+from sync_manifest import (
+    BucketListing,
+    ChecksumReader,
+    SyncManifest,
+    blob_checksums,
+    file_checksums,
+    same_object,
+)
 
 
 BUCKET_NAME = "de_hw3_2026"
 CREDENTIALS_FILE = "secrets/keys.json"
-client = storage.Client.from_service_account_json(CREDENTIALS_FILE)
 
 DATA_TYPES = ["green", "yellow"]
 YEARS = ["2019", "2020"]
 MONTHS = [f"{i:02d}" for i in range(1, 13)]
-BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+BASE_URL = os.environ.get("TRIP_DATA_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data")
 DOWNLOAD_DIR = "."
 CHUNK_SIZE = 8 * 1024 * 1024
+METRICS_FILE = os.environ.get("INGEST_METRICS_FILE")
+MANIFEST_FILE = os.environ.get("SYNC_MANIFEST_FILE", "sync_manifest.json")
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-bucket = client.bucket(BUCKET_NAME)
+metrics = IngestMetrics("load_yellow_taxi_data", METRICS_FILE)
+manifest = SyncManifest(MANIFEST_FILE)
 
 
-def download_file(data_type, year, month):
-    filename = f"{data_type}_tripdata_{year}-{month}.parquet"
+@lru_cache(maxsize=None)
+def get_client():
+    # Honours STORAGE_EMULATOR_HOST, so a fake-gcs-server can stand in for GCS
+    if os.environ.get("STORAGE_EMULATOR_HOST"):
+        return storage.Client.create_anonymous_client()
+    return storage.Client.from_service_account_json(CREDENTIALS_FILE)
+
+
+def get_bucket():
+    return get_client().bucket(BUCKET_NAME)
+
+
+download_limiter = AIMDLimiter("download")
+upload_limiter = AIMDLimiter("upload")
+
+
+def object_name(data_type, year, month):
+    return f"{data_type}_tripdata_{year}-{month}.parquet"
+
+
+def download_file(data_type, year, month, max_retries=3):
+    filename = object_name(data_type, year, month)
     url = f"{BASE_URL}/{filename}"
     file_path = os.path.join(DOWNLOAD_DIR, filename)
     print(file_path)
-    try:
-        print(f"Downloading {url}...")
-        urllib.request.urlretrieve(url, file_path)
-        print(f"Downloaded: {file_path}")
-        return file_path
-    except Exception as e:
-        print(f"Failed to download {url}: {e}")
-        return None
+
+    for attempt in range(max_retries):
+        try:
+            print(f"Downloading {url}...")
+            with download_limiter.slot():
+                start = time.perf_counter()
+                with metrics.stage(filename, "download"):
+                    etag = range_download.download(url, file_path)
+                download_limiter.success(time.perf_counter() - start, os.path.getsize(file_path))
+            print(f"Downloaded: {file_path}")
+            manifest.note_source(filename, etag)
+            return file_path
+        except Exception as e:
+            print(f"Failed to download {url}: {e}")
+            status = http_status(e)
+            if is_throttled(e):
+                download_limiter.throttled()
+            elif status is not None and 400 <= status < 500:
+                # Missing months and the like will not fix themselves
+                return None
+
+        if attempt + 1 < max_retries:
+            time.sleep(backoff_delay(attempt))
+
+    return None
 
 
 def create_bucket(bucket_name):
+    client = get_client()
     try:
         bucket = client.get_bucket(bucket_name)
         project_bucket_ids = [bckt.id for bckt in client.list_buckets()]
@@ -54,50 +110,273 @@ def create_bucket(bucket_name):
         sys.exit(1)
 
 
-def verify_gcs_upload(blob_name):
-    return storage.Blob(bucket=bucket, name=blob_name).exists(client)
-
-
 def upload_to_gcs(file_path, max_retries=3):
     blob_name = os.path.basename(file_path)
-    blob = bucket.blob(blob_name)
+    blob = get_bucket().blob(blob_name)
     blob.chunk_size = CHUNK_SIZE
+    checksums = file_checksums(file_path)
 
     for attempt in range(max_retries):
         try:
             print(f"Uploading {file_path} to {BUCKET_NAME} (Attempt {attempt + 1})...")
-            blob.upload_from_filename(file_path)
+            with upload_limiter.slot():
+                start = time.perf_counter()
+                with metrics.stage(blob_name, "upload"):
+                    blob.upload_from_filename(file_path)
+                upload_limiter.success(time.perf_counter() - start, os.path.getsize(file_path))
             print(f"Uploaded: gs://{BUCKET_NAME}/{blob_name}")
 
-            if verify_gcs_upload(blob_name):
+            # The upload response carries the stored object's size and checksums
+            if same_object(checksums, blob_checksums(blob)):
                 print(f"Verification successful for {blob_name}")
-                return
+                manifest.record(blob_name, checksums)
+                metrics.done(blob_name, nbytes=checksums["size"])
+                return True
             else:
                 print(f"Verification failed for {blob_name}, retrying...")
         except Exception as e:
             print(f"Failed to upload {file_path} to GCS: {e}")
+            if is_throttled(e):
+                upload_limiter.throttled()
 
-        time.sleep(5)
+        if attempt + 1 < max_retries:
+            time.sleep(backoff_delay(attempt))
 
     print(f"Giving up on {file_path} after {max_retries} attempts.")
+    return False
+
+
+def download_and_upload(tasks, queue_size=8):
+    """Run downloads and uploads as two overlapping stages.
+
+    Each finished download goes straight onto a bounded queue that the upload
+    workers drain, so uploads start with the first file instead of after the
+    last one. A full queue blocks the downloaders, which caps how many files
+    wait on local disk; each file is removed once its upload is verified
+    (failed ones stay for the next run to reuse). Each stage starts enough
+    threads for its limiter's ceiling; how many actually run is up to the
+    limiter. Returns the number of files that were uploaded.
+    """
+    ready = queue.Queue(maxsize=queue_size)
+    uploaded = []
+
+    def download(task):
+        file_path = download_file(*task)
+        if file_path is not None:
+            ready.put(file_path)
+
+    def upload():
+        while True:
+            file_path = ready.get()
+            if file_path is None:
+                return
+            try:
+                if upload_to_gcs(file_path):
+                    uploaded.append(file_path)
+                    os.remove(file_path)
+            except Exception as e:
+                # Keep draining the queue, or the downloaders would block on it forever
+                print(f"Failed to upload {file_path}: {e}")
+
+    uploaders = [threading.Thread(target=upload, daemon=True) for _ in range(upload_limiter.maximum)]
+    for t in uploaders:
+        t.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=download_limiter.maximum) as executor:
+            list(executor.map(download, tasks))
+    finally:
+        for _ in uploaders:
+            ready.put(None)
+        for t in uploaders:
+            t.join()
+    return len(uploaded)
+
+
+class GCSBackend:
+    """Resumable uploads into a GCS bucket, read from a stream CHUNK_SIZE bytes at a time."""
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+
+    def url(self, name):
+        return f"gs://{self.bucket_name}/{name}"
+
+    def upload_stream(self, name, stream, size=None):
+        """Upload stream as name and return the stored object's checksums."""
+        blob = get_client().bucket(self.bucket_name).blob(name)
+        # Setting chunk_size makes upload_from_file use a resumable session,
+        # so only one chunk of the response is held in memory at a time
+        blob.chunk_size = CHUNK_SIZE
+        try:
+            stream.tell()
+        except (AttributeError, OSError):
+            # The resumable upload calls tell() between chunks; an HTTP response cannot
+            stream = ChecksumReader(stream)
+        blob.upload_from_file(stream, size=size, rewind=False)
+        return blob_checksums(blob)
+
+    def listing(self):
+        return BucketListing(get_client(), self.bucket_name).load().objects
+
+
+class LocalBackend:
+    """Writes objects under a local directory; a stand-in for GCS when testing."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def url(self, name):
+        return os.path.join(self.root, name)
+
+    def upload_stream(self, name, stream, size=None):
+        """Write stream to name and return the stored file's checksums."""
+        partial = self.url(name) + ".part"
+        with open(partial, "wb") as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        if size is not None and os.path.getsize(partial) != size:
+            os.remove(partial)
+            raise IOError(f"Short write for {name}: expected {size} bytes")
+        os.replace(partial, self.url(name))
+        return file_checksums(self.url(name))
+
+    def listing(self):
+        return {
+            name: file_checksums(self.url(name))
+            for name in os.listdir(self.root)
+            if not name.endswith(".part")
+        }
+
+
+def stream_to_storage(data_type, year, month, backend, max_retries=3):
+    """Pipe the HTTP response straight into the backend without touching local disk."""
+    filename = object_name(data_type, year, month)
+    url = f"{BASE_URL}/{filename}"
+
+    for attempt in range(max_retries):
+        try:
+            print(f"Streaming {url} to {backend.url(filename)} (Attempt {attempt + 1})...")
+            with upload_limiter.slot():
+                start = time.perf_counter()
+                with metrics.stage(filename, "stream"), urllib.request.urlopen(
+                    url, timeout=range_download.TIMEOUT
+                ) as response:
+                    length = response.headers.get("Content-Length")
+                    size = int(length) if length is not None else None
+                    reader = ChecksumReader(response)
+                    stored = backend.upload_stream(filename, reader, size)
+                    manifest.note_source(filename, response.headers.get("ETag"))
+                upload_limiter.success(time.perf_counter() - start, reader.size)
+            print(f"Uploaded: {backend.url(filename)}")
+
+            if same_object(reader.checksums(), stored):
+                print(f"Verification successful for {filename}")
+                manifest.record(filename, stored)
+                metrics.done(filename, nbytes=reader.size)
+                return backend.url(filename)
+            else:
+                print(f"Verification failed for {filename}, retrying...")
+        except Exception as e:
+            # The response body cannot be rewound, so a failed attempt starts a new request
+            print(f"Failed to stream {url}: {e}")
+            status = http_status(e)
+            if is_throttled(e):
+                upload_limiter.throttled()
+            elif status is not None and 400 <= status < 500:
+                # Missing months and the like will not fix themselves
+                return None
+
+        if attempt + 1 < max_retries:
+            time.sleep(backoff_delay(attempt))
+
+    print(f"Giving up on {filename} after {max_retries} attempts.")
+    return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load NYC taxi Parquet files into GCS")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Pipe each download straight into the bucket instead of staging it on local disk",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["gcs", "local"],
+        default="gcs",
+        help="Storage backend for --stream; 'local' writes into --local-dir",
+    )
+    parser.add_argument("--local-dir", default="lake", help="Target directory for the local backend")
+    parser.add_argument(
+        "--download-workers", type=int, default=4, help="Starting number of concurrent downloads"
+    )
+    parser.add_argument(
+        "--upload-workers", type=int, default=4, help="Starting number of concurrent uploads"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Ceiling the adaptive concurrency of each stage may grow to",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Downloaded files allowed to wait for an upload worker",
+    )
+    parser.add_argument(
+        "--check-source",
+        action="store_true",
+        help="Also re-sync files whose source ETag changed since they were uploaded (one HEAD per file)",
+    )
+    parser.add_argument(
+        "--full-resync",
+        action="store_true",
+        help="Download and upload every file, even those already in sync",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    create_bucket(BUCKET_NAME)
+    args = parse_args()
+    download_limiter = AIMDLimiter("download", initial=args.download_workers, maximum=args.max_workers)
+    upload_limiter = AIMDLimiter("upload", initial=args.upload_workers, maximum=args.max_workers)
 
-    tasks = [
+    all_tasks = [
         (data_type, year, month)
         for data_type in DATA_TYPES
         for year in YEARS
         for month in MONTHS
     ]
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        file_paths = list(executor.map(lambda args: download_file(*args), tasks))
+    if args.stream and args.backend == "local":
+        backend = LocalBackend(args.local_dir)
+    else:
+        create_bucket(BUCKET_NAME)
+        backend = GCSBackend(BUCKET_NAME)
+
+    # One listing of the bucket decides what is already in sync
+    manifest.load_listing(backend.listing())
+
+    def needs_sync(task):
+        if args.full_resync:
+            return True
+        name = object_name(*task)
+        source_etag = range_download.resolve(f"{BASE_URL}/{name}")[2] if args.check_source else None
+        return not manifest.is_current(name, source_etag)
 
-    valid_paths = [p for p in file_paths if p is not None]
+    tasks = [task for task in all_tasks if needs_sync(task)]
+    print(f"{len(all_tasks) - len(tasks)}/{len(all_tasks)} files already in sync, skipping them.")
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        executor.map(upload_to_gcs, valid_paths)
+    if args.stream:
+        # Download and upload are one stage here, paced by the upload limiter
+        with ThreadPoolExecutor(max_workers=upload_limiter.maximum) as executor:
+            results = list(executor.map(lambda task: stream_to_storage(*task, backend), tasks))
+        succeeded = sum(1 for r in results if r is not None)
+    else:
+        succeeded = download_and_upload(tasks, queue_size=args.queue_size)
 
-    print(f"All files processed. {len(valid_paths)}/{len(tasks)} succeeded.")
\ No newline at end of file
+    print(f"All files processed. {succeeded}/{len(tasks)} succeeded.")
+    metrics.summary()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""Parallel, resumable HTTP downloads for the TLC trip files.
+
+A file is split into fixed-size byte ranges that are fetched concurrently,
+each worker thread keeping its own keep-alive connection per host. Ranges are
+written straight into a preallocated ``<path>.part`` file; a sidecar
+``<path>.part.json`` records which ranges are complete, so an interrupted
+download picks up where it stopped instead of starting over. Once every range
+is in, the size (and the ETag, when it is a plain MD5) is checked and the file
+is renamed into place.
+
+Servers that do not advertise range support, or files smaller than one part,
+fall back to a single streamed GET.
+"""
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PART_SIZE = 16 * 1024 * 1024
+WORKERS = 8
+READ_SIZE = 1024 * 1024
+RETRIES = 3
+TIMEOUT = 60
+
+_local = threading.local()
+
+
+class _KeepMethodRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # urllib turns a redirected HEAD into a GET, which would start the full download
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_request = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_request is not None:
+            new_request.method = req.get_method()
+        return new_request
+
+
+_opener = urllib.request.build_opener(_KeepMethodRedirectHandler)
+
+
+def resolve(url):
+    """Follow redirects with a HEAD request; return (final_url, size, etag, ranges)."""
+    request = urllib.request.Request(url, method="HEAD")
+    with _opener.open(request, timeout=TIMEOUT) as response:
+        length = response.headers.get("Content-Length")
+        return (
+            response.url,
+            int(length) if length is not None else None,
+            response.headers.get("ETag"),
+            response.headers.get("Accept-Ranges", "").lower() == "bytes",
+        )
+
+
+def _connection(parts):
+    """One keep-alive connection per host for the calling thread."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = (parts.scheme, parts.netloc)
+    if key not in connections:
+        conn_class = (
+            http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        )
+        connections[key] = conn_class(parts.netloc, timeout=TIMEOUT)
+    return connections[key]
+
+
+def _drop_connection(parts):
+    conn = getattr(_local, "connections", {}).pop((parts.scheme, parts.netloc), None)
+    if conn is not None:
+        conn.close()
+
+
+def fetch_range(url, part_path, start, end):
+    """GET bytes start..end (inclusive) of url and write them at the same offset."""
+    parts = urllib.parse.urlsplit(url)
+    target = parts.path + (f"?{parts.query}" if parts.query else "")
+    last_error = None
+    for _ in range(RETRIES):
+        conn = _connection(parts)
+        try:
+            conn.request("GET", target, headers={"Range": f"bytes={start}-{end}"})
+            response = conn.getresponse()
+            if response.status != 206:
+                response.read()
+                raise IOError(f"Expected 206 for range {start}-{end}, got {response.status}")
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    block = response.read(min(READ_SIZE, remaining))
+                    if not block:
+                        raise IOError(f"Connection closed {remaining} bytes short in range {start}-{end}")
+                    f.write(block)
+                    remaining -= len(block)
+            return
+        except (OSError, http.client.HTTPException) as e:
+            last_error = e
+            _drop_connection(parts)
+    raise IOError(f"Range {start}-{end} failed after {RETRIES} attempts: {last_error}")
+
+
+def _load_state(state_path, size, etag):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if state.get("size") != size or state.get("etag") != etag:
+        # The remote file changed since the partial download was started
+        return set()
+    return set(state.get("done", []))
+
+
+def _save_state(state_path, url, size, etag, done):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"url": url, "size": size, "etag": etag, "done": sorted(done)}, f)
+    os.replace(tmp_path, state_path)
+
+
+def _md5_etag(etag):
+    """Return the hex digest if the ETag is a plain MD5 (not a multipart upload ETag)."""
+    value = (etag or "").removeprefix("W/").strip('"')
+    return value if re.fullmatch(r"[0-9a-f]{32}", value) else None
+
+
+def verify(path, size, etag):
+    actual = os.path.getsize(path)
+    if size is not None and actual != size:
+        raise IOError(f"{path} is {actual} bytes, expected {size}")
+    expected_md5 = _md5_etag(etag)
+    if expected_md5:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(READ_SIZE), b""):
+                digest.update(block)
+        if digest.hexdigest() != expected_md5:
+            raise IOError(f"{path} does not match ETag {etag}")
+
+
+def download(url, path, part_size=PART_SIZE, workers=WORKERS):
+    """Download url to path with concurrent range requests, resuming a previous partial run.
+
+    Returns the source ETag (None if the server sent none).
+    """
+    final_url, size, etag, ranges = resolve(url)
+
+    if os.path.exists(path) and size is not None and os.path.getsize(path) == size:
+        print(f"{path} already complete, skipping download")
+        return etag
+
+    part_path = path + ".part"
+    state_path = part_path + ".json"
+
+    if not ranges or size is None or size <= part_size:
+        with urllib.request.urlopen(final_url, timeout=TIMEOUT) as response, open(part_path, "wb") as f:
+            shutil.copyfileobj(response, f, READ_SIZE)
+        verify(part_path, size, etag)
+        os.replace(part_path, path)
+        return etag
+
+    done = _load_state(state_path, size, etag) if os.path.exists(part_path) else set()
+    if not done:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+        _save_state(state_path, final_url, size, etag, done)
+
+    offsets = [start for start in range(0, size, part_size) if start not in done]
+    if done:
+        print(f"Resuming {path}: {len(done)} of {len(done) + len(offsets)} parts already present")
+
+    lock = threading.Lock()
+
+    def fetch(start):
+        fetch_range(final_url, part_path, start, min(start + part_size, size) - 1)
+        with lock:
+            done.add(start)
+            _save_state(state_path, final_url, size, etag, done)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() re-raises the first failed range; completed ranges stay recorded for the next run
+        list(executor.map(fetch, offsets))
+
+    verify(part_path, size, etag)
+    os.replace(part_path, path)
+    os.remove(state_path)
+    return etag
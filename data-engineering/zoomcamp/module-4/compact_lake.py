@@ -0,0 +1,256 @@
+"""Compact the monthly objects of one service into well-sized Parquet files.
+
+The sources are the monthly objects the loaders wrote for the chosen years:
+Parquet from load_taxi_data.py (in the LAKE_LAYOUT it was run with), and
+for FHV the flat .csv or .parquet files from load_fhv_data.py. They are read
+one file at a time, cast to the registered schema, regrouped into
+pickup-sorted row groups and written as part files of roughly --target-mb
+each, under a new generation prefix:
+
+    compacted/service=<service>/gen=<timestamp>-<id>/year=<yyyy>/part-00000.parquet
+
+Tables in the hive layout are partitioned by year and month, so they keep
+both keys and are compacted month by month:
+
+    compacted/service=<service>/gen=<timestamp>-<id>/year=<yyyy>/month=<mm>/part-00000.parquet
+
+Nothing the external table reads is touched until the new generation is
+complete and its row count matches the sources. The table is then re-pointed
+at the generation with a single metadata update, so queries see either the
+old files or the new ones, never a mix. The generation in use is recorded in
+compacted/service=<service>/CURRENT.
+
+Running the loaders again recreates the tables over the monthly files, so
+compact after loading.
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery, storage
+
+import schemas
+from convert_to_parquet import ROW_GROUP_ROWS, normalize_bases, open_csv_stream, optimized_writer, regroup
+from load_fhv_data import YEARS as FHV_YEARS
+from load_taxi_data import YEARS as TAXI_YEARS
+
+BUCKET_NAME = "de_hw4_2026"
+CREDENTIALS_FILE = "secrets/keys.json"
+storage_client = storage.Client.from_service_account_json(CREDENTIALS_FILE)
+bq_client = bigquery.Client.from_service_account_json(CREDENTIALS_FILE)
+
+BQ_DATASET = "elt-demo-de.nytaxi"
+CHUNK_SIZE = 8 * 1024 * 1024
+TARGET_MB = 256
+LAKE_LAYOUT = os.environ.get("LAKE_LAYOUT", "flat")
+# FHV is only loaded flat, as CSV or (with FHV_FORMAT=parquet) Parquet
+SOURCE_SUFFIXES = (".parquet", ".csv")
+
+bucket = storage_client.bucket(BUCKET_NAME)
+
+
+def loaded_years(service):
+    """The years the service's loader loads."""
+    return FHV_YEARS if service == "fhv" else TAXI_YEARS
+
+
+def lake_layout(service):
+    return "flat" if service == "fhv" else LAKE_LAYOUT
+
+
+def source_partitions(service, year):
+    """Map each output partition (e.g. "year=2019" or "year=2019/month=03") to its source objects.
+
+    If a month was loaded as both CSV and Parquet, only the Parquet object is
+    used.
+    """
+    if lake_layout(service) == "hive":
+        prefix = f"service={service}/year={year}/"
+    else:
+        prefix = f"{service}_tripdata_{year}-"
+    by_month = {}
+    for blob in storage_client.list_blobs(BUCKET_NAME, prefix=prefix):
+        stem, suffix = os.path.splitext(os.path.basename(blob.name))
+        if suffix in SOURCE_SUFFIXES and (stem not in by_month or suffix == ".parquet"):
+            by_month[stem] = blob
+
+    partitions = {}
+    for stem in sorted(by_month):
+        if lake_layout(service) == "hive":
+            month = stem.rsplit("-", 1)[-1]
+            partition = f"year={year}/month={month}"
+        else:
+            partition = f"year={year}"
+        partitions.setdefault(partition, []).append(by_month[stem])
+    return partitions
+
+
+def source_tables(blobs, schema, workdir, expected_rows):
+    """Yield each source's rows cast to schema, downloading one object at a time.
+
+    The row count each source should contribute, from its Parquet footer or
+    its CSV line count, is appended to expected_rows.
+    """
+    for blob in blobs:
+        local_path = os.path.join(workdir, os.path.basename(blob.name))
+        print(f"Reading gs://{BUCKET_NAME}/{blob.name}...")
+        blob.download_to_filename(local_path)
+        if local_path.endswith(".csv"):
+            with open(local_path, "rb") as f:
+                expected_rows.append(sum(1 for _ in f) - 1)
+            for batch in open_csv_stream(local_path, schema):
+                yield normalize_bases(pa.Table.from_batches([batch]).cast(schema))
+        else:
+            parquet_file = pq.ParquetFile(local_path)
+            expected_rows.append(parquet_file.metadata.num_rows)
+            for i in range(parquet_file.num_row_groups):
+                yield parquet_file.read_row_group(i).select(schema.names).cast(schema)
+        os.remove(local_path)
+
+
+def upload_part(local_path, blob_name):
+    blob = bucket.blob(blob_name)
+    blob.chunk_size = CHUNK_SIZE
+    blob.upload_from_filename(local_path)
+    print(f"Uploaded: gs://{BUCKET_NAME}/{blob_name}")
+    os.remove(local_path)
+
+
+def compact_partition(service, blobs, partition_prefix, target_bytes, workdir):
+    """Rewrite blobs into part files of about target_bytes; return (rows_in, rows_out)."""
+    schema = schemas.get_schema(service)
+    sort_column = schemas.pickup_column(schema)
+    expected_rows = []
+
+    rows_out = 0
+    part = 0
+    writer = None
+    local_path = os.path.join(workdir, "part.parquet")
+    for row_group in regroup(source_tables(blobs, schema, workdir, expected_rows), ROW_GROUP_ROWS):
+        if writer is None:
+            writer = optimized_writer(local_path, schema)
+        writer.write_table(row_group.sort_by(sort_column), row_group_size=ROW_GROUP_ROWS)
+        rows_out += row_group.num_rows
+        # Row groups are flushed to the file as they are written, so its size tracks the output
+        if os.path.getsize(local_path) >= target_bytes:
+            writer.close()
+            writer = None
+            upload_part(local_path, f"{partition_prefix}/part-{part:05d}.parquet")
+            part += 1
+    if writer is not None:
+        writer.close()
+        upload_part(local_path, f"{partition_prefix}/part-{part:05d}.parquet")
+    return sum(expected_rows), rows_out
+
+
+def point_table_at(service, generation_prefix, years):
+    """Swap the external table to the new generation in one metadata update."""
+    table_id = f"{BQ_DATASET}.{service}_tripdata"
+    table_root = f"gs://{BUCKET_NAME}/{generation_prefix}"
+
+    external_config = bigquery.ExternalConfig("PARQUET")
+    external_config.autodetect = True
+    external_config.source_uris = [f"{table_root}/year={year}/*" for year in years]
+    hive_partitioning = bigquery.HivePartitioningOptions()
+    hive_partitioning.mode = "CUSTOM"
+    if lake_layout(service) == "hive":
+        hive_partitioning.source_uri_prefix = f"{table_root}/{{year:INTEGER}}/{{month:INTEGER}}"
+    else:
+        hive_partitioning.source_uri_prefix = f"{table_root}/{{year:INTEGER}}"
+    external_config.hive_partitioning = hive_partitioning
+
+    try:
+        table = bq_client.get_table(table_id)
+    except NotFound:
+        table = bigquery.Table(table_id)
+        table.external_data_configuration = external_config
+        bq_client.create_table(table)
+    else:
+        table.external_data_configuration = external_config
+        bq_client.update_table(table, ["external_data_configuration"])
+    print(f"External table {table_id} now reads {table_root}")
+
+
+def delete_prefix(prefix):
+    for blob in storage_client.list_blobs(BUCKET_NAME, prefix=prefix + "/"):
+        blob.delete()
+        print(f"Deleted gs://{BUCKET_NAME}/{blob.name}")
+
+
+def delete_old_generations(service, keep_prefix):
+    root = f"compacted/service={service}/gen="
+    for blob in storage_client.list_blobs(BUCKET_NAME, prefix=root):
+        if not blob.name.startswith(keep_prefix + "/"):
+            blob.delete()
+            print(f"Deleted gs://{BUCKET_NAME}/{blob.name}")
+
+
+def compact(service, years=None, target_mb=TARGET_MB, delete_old=False):
+    """Compact years (default: the years the loader loads, skipping any without objects)."""
+    # The suffix keeps two runs in the same second from sharing (and cleaning up) a generation
+    generation = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + f"-{uuid.uuid4().hex[:8]}"
+    generation_prefix = f"compacted/service={service}/gen={generation}"
+    requested = years is not None
+    compacted_years = []
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for year in years if requested else loaded_years(service):
+                partitions = source_partitions(service, year)
+                if not partitions:
+                    if requested:
+                        raise RuntimeError(f"No source objects found for {service} {year}")
+                    print(f"No source objects found for {service} {year}, skipping it.")
+                    continue
+                for partition, blobs in partitions.items():
+                    rows_in, rows_out = compact_partition(
+                        service, blobs, f"{generation_prefix}/{partition}", target_mb * 1024 * 1024, workdir
+                    )
+                    if rows_in != rows_out:
+                        raise RuntimeError(
+                            f"{service} {partition}: wrote {rows_out:,} rows but the sources hold {rows_in:,}; "
+                            f"leaving the table on its current files"
+                        )
+                    print(f"{service} {partition}: {rows_out:,} rows compacted")
+                compacted_years.append(year)
+        if not compacted_years:
+            raise RuntimeError(f"No source objects found for {service}")
+
+        point_table_at(service, generation_prefix, compacted_years)
+    except BaseException:
+        # The table still reads the previous files; nothing refers to this generation
+        print(f"Compaction failed, removing gs://{BUCKET_NAME}/{generation_prefix}/")
+        delete_prefix(generation_prefix)
+        raise
+    bucket.blob(f"compacted/service={service}/CURRENT").upload_from_string(generation)
+
+    if delete_old:
+        delete_old_generations(service, generation_prefix)
+    return generation_prefix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact monthly trip objects behind an external table")
+    parser.add_argument("--service", required=True, choices=sorted(schemas.SCHEMAS))
+    parser.add_argument(
+        "--year",
+        action="append",
+        dest="years",
+        help="Year to include (repeatable); the table will read exactly these years. "
+        "Default: the years the service's loader loads",
+    )
+    parser.add_argument("--target-mb", type=int, default=TARGET_MB, help="Approximate size of each output file")
+    parser.add_argument(
+        "--delete-old",
+        action="store_true",
+        help="Delete earlier compacted generations once the table points at the new one",
+    )
+    args = parser.parse_args()
+
+    compact(args.service, args.years, args.target_mb, args.delete_old)
+    print("Done.")
@@ -1,10 +1,71 @@
-from fastparquet import ParquetFile
+"""Convert Parquet trip files back to CSV (optionally .csv.gz).
 
-# Reading the data from Parquet File
-pf = ParquetFile("fhv_tripdata_2019-01.parquet")
+Each file is read one row group at a time and written with Arrow's CSV
+writer, so memory stays at about one row group whatever the file size.
+Several files are converted in parallel; Arrow releases the GIL while
+decoding, encoding and compressing, so threads are enough.
 
-# Converting data in to pandas dataFrame
-dataFrame = pf.to_pandas()
+    python convert_to_csv.py                      # every fhv_tripdata_2019-*.parquet here
+    python convert_to_csv.py --gzip a.parquet b.parquet
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Converting to CSV
-dataFrame.to_csv("fhv_tripdata_2019-01.csv", index=False)
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+DEFAULT_PATTERN = "fhv_tripdata_2019-*.parquet"
+WORKERS = 4
+
+
+def convert_parquet_to_csv(parquet_path, compress=False):
+    """Write parquet_path as .csv (or .csv.gz) next to it; return the output path."""
+    csv_path = parquet_path.removesuffix(".parquet") + (".csv.gz" if compress else ".csv")
+
+    print(f"Converting {parquet_path} to {csv_path}...")
+    start = time.perf_counter()
+    parquet_file = pq.ParquetFile(parquet_path)
+    try:
+        with pa.OSFile(csv_path, "wb") as raw:
+            sink = pa.CompressedOutputStream(raw, "gzip") if compress else raw
+            with pa_csv.CSVWriter(sink, parquet_file.schema_arrow) as writer:
+                for i in range(parquet_file.num_row_groups):
+                    writer.write_table(parquet_file.read_row_group(i))
+            if compress:
+                sink.close()
+    except Exception:
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+        raise
+    print(f"Created {csv_path} in {time.perf_counter() - start:.1f}s")
+    return csv_path
+
+
+def convert_files(parquet_paths, compress=False, workers=WORKERS):
+    """Convert several files in parallel; return the paths that were written."""
+    def convert(path):
+        try:
+            return convert_parquet_to_csv(path, compress)
+        except Exception as e:
+            print(f"Failed to convert {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(convert, parquet_paths))
+    return [path for path in results if path is not None]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Parquet files to CSV")
+    parser.add_argument("paths", nargs="*", help=f"Parquet files (default: {DEFAULT_PATTERN})")
+    parser.add_argument("--gzip", action="store_true", help="Write .csv.gz instead of .csv")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Files converted at once")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(DEFAULT_PATTERN))
+    written = convert_files(paths, args.gzip, args.workers)
+    print(f"\nConverted {len(written)}/{len(paths)} files.")
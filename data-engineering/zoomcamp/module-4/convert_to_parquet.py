@@ -0,0 +1,130 @@
+"""Streaming csv.gz -> Parquet conversion for the trip files.
+
+Kept free of GCS/BigQuery clients so load_taxi_data.py can run it in worker
+processes: the CSV parsing and Parquet encoding are CPU-bound, and only the
+file paths cross the process boundary.
+
+Two layouts are available. "default" writes each CSV block as it arrives
+with the writer's defaults. "optimized" is meant for querying the lake
+directly: rows are regrouped into ROW_GROUP_ROWS row groups, each sorted by
+pickup time (a full sort would hold the whole month in memory; the files
+are close to chronological already, so per-group sorting keeps the min/max
+statistics tight), compressed with zstd, with dictionary encoding on the
+zone and payment columns, and with a page index so readers can skip pages
+as well as row groups on date and zone filters.
+
+Base license columns (FHV) are trimmed and upper-cased, with blanks as
+nulls, so the same base compares equal across months.
+"""
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+import schemas
+
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+LAYOUTS = ("default", "optimized")
+ROW_GROUP_ROWS = 1_000_000
+DICTIONARY_COLUMNS = {"pulocationid", "dolocationid", "payment_type"}
+# The same base shows up as "B00001", "b00001 " or "" depending on the month
+BASE_COLUMNS = {"dispatching_base_num", "affiliated_base_number"}
+
+
+def open_csv_stream(gz_path, schema):
+    # pyarrow decompresses .gz paths on the fly; only one block is held at a time
+    return pa_csv.open_csv(
+        gz_path,
+        read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=schemas.read_types(schema),
+            include_columns=schema.names,
+        ),
+    )
+
+
+def normalize_bases(table):
+    """Trim and upper-case the base license columns, turning blanks into nulls."""
+    for i, name in enumerate(table.column_names):
+        if name.lower() in BASE_COLUMNS:
+            column = pc.utf8_upper(pc.utf8_trim_whitespace(table.column(i)))
+            table = table.set_column(i, name, pc.if_else(pc.equal(column, ""), None, column))
+    return table
+
+
+def regroup(tables, rows):
+    """Re-slice a stream of tables into tables of exactly ``rows`` rows (the last may be shorter)."""
+    buffered = []
+    buffered_rows = 0
+    for table in tables:
+        buffered.append(table)
+        buffered_rows += table.num_rows
+        while buffered_rows >= rows:
+            combined = pa.concat_tables(buffered)
+            yield combined.slice(0, rows)
+            rest = combined.slice(rows)
+            buffered = [rest]
+            buffered_rows = rest.num_rows
+    if buffered_rows:
+        yield pa.concat_tables(buffered)
+
+
+def optimized_writer(parquet_path, schema):
+    """ParquetWriter for the "optimized" layout; write pickup-sorted row groups to it."""
+    sort_column = schemas.pickup_column(schema)
+    return pq.ParquetWriter(
+        parquet_path,
+        schema,
+        compression="zstd",
+        use_dictionary=[name for name in schema.names if name.lower() in DICTIONARY_COLUMNS],
+        write_statistics=True,
+        write_page_index=True,
+        sorting_columns=[pq.SortingColumn(schema.get_field_index(sort_column))],
+    )
+
+
+def write_parquet_stream(gz_path, parquet_path, schema, layout="default"):
+    """Write the CSV blocks of gz_path as they are parsed, cast to the registered schema."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown parquet layout {layout!r}, expected one of {LAYOUTS}")
+    reader = open_csv_stream(gz_path, schema)
+    tables = (normalize_bases(pa.Table.from_batches([batch]).cast(schema)) for batch in reader)
+
+    if layout == "default":
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            for table in tables:
+                writer.write_table(table)
+        return
+
+    sort_column = schemas.pickup_column(schema)
+    with optimized_writer(parquet_path, schema) as writer:
+        for row_group in regroup(tables, ROW_GROUP_ROWS):
+            writer.write_table(row_group.sort_by(sort_column), row_group_size=ROW_GROUP_ROWS)
+
+
+def convert_gz_to_parquet(gz_path, data_type, layout="default"):
+    """Stream .csv.gz into .parquet without an intermediate CSV.
+
+    Returns (parquet_path, seconds); parquet_path is None when the file does
+    not fit the registered schema.
+    """
+    # e.g. green_tripdata_2019-01.csv.gz -> green_tripdata_2019-01.parquet
+    parquet_path = gz_path.removesuffix(".csv.gz") + ".parquet"
+
+    print(f"Converting {gz_path} to parquet...")
+    start = time.perf_counter()
+    try:
+        write_parquet_stream(gz_path, parquet_path, schemas.get_schema(data_type), layout)
+    except pa.ArrowException as e:
+        # Missing columns or values that do not fit the registered schema
+        print(f"Failed to convert {gz_path}: {e}")
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        return None, time.perf_counter() - start
+    print(f"Created {parquet_path}")
+
+    os.remove(gz_path)
+    return parquet_path, time.perf_counter() - start
@@ -7,6 +7,10 @@ from concurrent.futures import ThreadPoolExecutor
 from google.cloud import storage, bigquery
 from google.api_core.exceptions import NotFound, Forbidden
 import time
+from adaptive_concurrency import AIMDLimiter, backoff_delay, is_throttled
+from convert_to_parquet import convert_gz_to_parquet
+from ingest_metrics import IngestMetrics
+from sync_manifest import BucketListing
 
 BASE_URL = "https://github.com/DataTalksClub/nyc-tlc-data/releases/download/fhv/"
 BASE_FILENAME = "fhv_tripdata_"
@@ -22,9 +26,18 @@ BQ_DATASET = "elt-demo-de.nytaxi"
 
 DOWNLOAD_DIR = "."
 CHUNK_SIZE = 8 * 1024 * 1024
+# Starting concurrency of the uploads; it adapts from there
+IO_WORKERS = 4
+# "parquet" converts each month to typed Parquet and builds a Parquet external table
+FHV_FORMAT = os.environ.get("FHV_FORMAT", "csv")
+PARQUET_LAYOUT = os.environ.get("PARQUET_LAYOUT", "default")
+METRICS_FILE = os.environ.get("INGEST_METRICS_FILE")
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 bucket = storage_client.bucket(BUCKET_NAME)
+metrics = IngestMetrics("load_fhv_data", METRICS_FILE)
+listing = BucketListing(storage_client, BUCKET_NAME, prefixes=[BASE_FILENAME])
+upload_limiter = AIMDLimiter("upload", initial=IO_WORKERS)
 
 
 def create_bucket(bucket_name):
@@ -44,10 +57,6 @@ def create_bucket(bucket_name):
         sys.exit(1)
 
 
-def file_exists_in_gcs(filename):
-    return storage.Blob(bucket=bucket, name=filename).exists(storage_client)
-
-
 def upload_to_gcs(file_path, max_retries=3):
     blob_name = os.path.basename(file_path)
     blob = bucket.blob(blob_name)
@@ -56,52 +65,72 @@ def upload_to_gcs(file_path, max_retries=3):
     for attempt in range(max_retries):
         try:
             print(f"Uploading {file_path} to {BUCKET_NAME} (Attempt {attempt + 1})...")
-            blob.upload_from_filename(file_path)
+            with upload_limiter.slot():
+                start = time.perf_counter()
+                with metrics.stage(blob_name, "upload"):
+                    blob.upload_from_filename(file_path)
+                upload_limiter.success(time.perf_counter() - start, os.path.getsize(file_path))
             print(f"Uploaded: gs://{BUCKET_NAME}/{blob_name}")
+            listing.record(blob)
             return True
         except Exception as e:
             print(f"Failed to upload {file_path} to GCS: {e}")
-        time.sleep(5)
+            if is_throttled(e):
+                upload_limiter.throttled()
+
+        if attempt + 1 < max_retries:
+            time.sleep(backoff_delay(attempt))
 
     print(f"Giving up on {file_path} after {max_retries} attempts.")
     return False
 
 
 def process_file(year, month):
-    """Download csv.gz, extract to csv, upload to GCS."""
+    """Download csv.gz, extract to csv (or convert to parquet), upload to GCS."""
     gz_filename = f"{BASE_FILENAME}{year}-{month}.csv.gz"
-    csv_filename = gz_filename.replace(".csv.gz", ".csv")
-    csv_path = os.path.join(DOWNLOAD_DIR, csv_filename)
     gz_path = os.path.join(DOWNLOAD_DIR, gz_filename)
+    suffix = ".parquet" if FHV_FORMAT == "parquet" else ".csv"
+    out_filename = gz_filename.replace(".csv.gz", suffix)
+    out_path = os.path.join(DOWNLOAD_DIR, out_filename)
 
-    if file_exists_in_gcs(csv_filename):
-        print(f"Skipping {csv_filename}, already in GCS.")
-        return csv_filename
+    if listing.exists(out_filename):
+        print(f"Skipping {out_filename}, already in GCS.")
+        return out_filename
 
     url = f"{BASE_URL}{gz_filename}"
     try:
         # Download
         print(f"Downloading {url}...")
-        urllib.request.urlretrieve(url, gz_path)
-
-        # Extract gz -> csv
-        print(f"Extracting {gz_filename}...")
-        with gzip.open(gz_path, "rb") as f_in:
-            with open(csv_path, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-
-        os.remove(gz_path)
-
-        # Upload csv to GCS
-        if upload_to_gcs(csv_path):
-            os.remove(csv_path)
-            return csv_filename
+        with metrics.stage(out_filename, "download"):
+            urllib.request.urlretrieve(url, gz_path)
+
+        if FHV_FORMAT == "parquet":
+            # Streams the gzip straight into typed Parquet and removes gz_path
+            parquet_path, seconds = convert_gz_to_parquet(gz_path, "fhv", PARQUET_LAYOUT)
+            metrics.add(out_filename, "convert", seconds)
+            converted = parquet_path is not None
+        else:
+            # Extract gz -> csv
+            print(f"Extracting {gz_filename}...")
+            with metrics.stage(out_filename, "decompress"):
+                with gzip.open(gz_path, "rb") as f_in:
+                    with open(out_path, "wb") as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+
+            os.remove(gz_path)
+            converted = True
+
+        # Upload to GCS; a failed conversion falls through to the cleanup
+        if converted and upload_to_gcs(out_path):
+            metrics.done(out_filename, nbytes=os.path.getsize(out_path))
+            os.remove(out_path)
+            return out_filename
 
     except Exception as e:
         print(f"Failed to process {gz_filename}: {e}")
 
     # Cleanup on failure
-    for f in [gz_path, csv_path]:
+    for f in [gz_path, out_path]:
         if os.path.exists(f):
             os.remove(f)
     return None
@@ -110,15 +139,22 @@ def process_file(year, month):
 def create_external_table():
     """Create external table for FHV data."""
     table_id = f"{BQ_DATASET}.fhv_tripdata"
-    uris = [
-        f"gs://{BUCKET_NAME}/{BASE_FILENAME}{year}-*.csv"
-        for year in YEARS
-    ]
 
-    external_config = bigquery.ExternalConfig("CSV")
-    external_config.source_uris = uris
-    external_config.autodetect = True
-    external_config.options.skip_leading_rows = 1
+    if FHV_FORMAT == "parquet":
+        # Types come from the Parquet files, and queries only scan the columns they read
+        external_config = bigquery.ExternalConfig("PARQUET")
+        external_config.source_uris = [
+            f"gs://{BUCKET_NAME}/{BASE_FILENAME}{year}-*.parquet"
+            for year in YEARS
+        ]
+    else:
+        external_config = bigquery.ExternalConfig("CSV")
+        external_config.source_uris = [
+            f"gs://{BUCKET_NAME}/{BASE_FILENAME}{year}-*.csv"
+            for year in YEARS
+        ]
+        external_config.autodetect = True
+        external_config.options.skip_leading_rows = 1
 
     table = bigquery.Table(table_id)
     table.external_data_configuration = external_config
@@ -133,14 +169,18 @@ def create_external_table():
 
 if __name__ == "__main__":
     create_bucket(BUCKET_NAME)
+    # Existence checks below are answered from this one listing
+    listing.load()
 
     tasks = [(year, month) for year in YEARS for month in MONTHS]
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
+    # Enough threads for the limiter's ceiling; the limiter decides how many upload at once
+    with ThreadPoolExecutor(max_workers=upload_limiter.maximum) as executor:
         results = list(executor.map(lambda args: process_file(*args), tasks))
 
     valid = [f for f in results if f is not None]
     print(f"\nUploaded {len(valid)}/{len(tasks)} files.")
+    metrics.summary()
 
     print("\n--- Creating external table in BigQuery ---")
     create_external_table()
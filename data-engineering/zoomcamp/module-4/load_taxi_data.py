@@ -1,13 +1,15 @@
+import multiprocessing
 import os
-import gzip
 import sys
-import shutil
-import urllib.request
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from google.cloud import storage, bigquery
 from google.api_core.exceptions import NotFound, Forbidden
 import time
-import polars as pl
+from adaptive_concurrency import AIMDLimiter, backoff_delay, http_status, is_throttled
+from convert_to_parquet import convert_gz_to_parquet
+from ingest_metrics import IngestMetrics
+import range_download
+from sync_manifest import BucketListing, SyncManifest, blob_checksums, file_checksums, same_object
 
 BUCKET_NAME = "de_hw4_2026"
 CREDENTIALS_FILE = "secrets/keys.json"
@@ -22,9 +24,44 @@ MONTHS = [f"{i:02d}" for i in range(1, 13)]
 BASE_URL = "https://github.com/DataTalksClub/nyc-tlc-data/releases/download" #/yellow/yellow_tripdata_2019-01.csv.gz
 DOWNLOAD_DIR = "."
 CHUNK_SIZE = 8 * 1024 * 1024
+# Starting concurrency of the download and upload stages; each adapts from there
+IO_WORKERS = 4
+CONVERT_WORKERS = os.cpu_count() or 1
+# "optimized" sorts row groups by pickup time and writes zstd, dictionaries and page indexes
+PARQUET_LAYOUT = os.environ.get("PARQUET_LAYOUT", "default")
+# "hive" uploads under service=<type>/year=<yyyy>/month=<mm>/ and partitions the external tables on it
+LAKE_LAYOUT = os.environ.get("LAKE_LAYOUT", "flat")
+METRICS_FILE = os.environ.get("INGEST_METRICS_FILE")
+MANIFEST_FILE = os.environ.get("SYNC_MANIFEST_FILE", "sync_manifest.json")
+# "1" reloads every month, even those the bucket already holds
+FULL_RESYNC = os.environ.get("FULL_RESYNC") == "1"
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 bucket = storage_client.bucket(BUCKET_NAME)
+metrics = IngestMetrics("load_taxi_data", METRICS_FILE)
+manifest = SyncManifest(MANIFEST_FILE)
+download_limiter = AIMDLimiter("download", initial=IO_WORKERS)
+upload_limiter = AIMDLimiter("upload", initial=IO_WORKERS)
+
+
+def object_prefix(data_type):
+    return f"service={data_type}/" if LAKE_LAYOUT == "hive" else f"{data_type}_tripdata_"
+
+
+def object_name(data_type, year, month):
+    """Where a month's parquet file lives in the bucket for the configured LAKE_LAYOUT."""
+    filename = f"{data_type}_tripdata_{year}-{month}.parquet"
+    if LAKE_LAYOUT == "hive":
+        return f"service={data_type}/year={year}/month={month}/{filename}"
+    return filename
+
+
+listing = BucketListing(storage_client, BUCKET_NAME, prefixes=[object_prefix(t) for t in DATA_TYPES])
+
+
+def metrics_unit(path):
+    """green_tripdata_2019-01.csv.gz / .parquet -> green_tripdata_2019-01"""
+    return os.path.basename(path).split(".")[0]
 
 
 def create_bucket(bucket_name):
@@ -41,97 +78,152 @@ def create_bucket(bucket_name):
         sys.exit(1)
 
 
-def file_exists_in_gcs(filename):
-    return storage.Blob(bucket=bucket, name=filename).exists(storage_client)
-
-
-
-
-def download_file(data_type, year, month):
+def download_file(data_type, year, month, max_retries=3):
     gz_filename = f"{data_type}_tripdata_{year}-{month}.csv.gz"
     url = f"{BASE_URL}/{data_type}/{gz_filename}"
     file_path = os.path.join(DOWNLOAD_DIR, gz_filename)
-    try:
-        print(f"Downloading {url}...")
-        urllib.request.urlretrieve(url, file_path)
-        print(f"Downloaded: {file_path}")
-        return file_path
-    except Exception as e:
-        print(f"Failed to download {url}: {e}")
-        return None
 
+    for attempt in range(max_retries):
+        try:
+            print(f"Downloading {url}...")
+            with download_limiter.slot():
+                start = time.perf_counter()
+                with metrics.stage(metrics_unit(file_path), "download"):
+                    etag = range_download.download(url, file_path)
+                download_limiter.success(time.perf_counter() - start, os.path.getsize(file_path))
+            print(f"Downloaded: {file_path}")
+            manifest.note_source(object_name(data_type, year, month), etag)
+            return file_path
+        except Exception as e:
+            print(f"Failed to download {url}: {e}")
+            status = http_status(e)
+            if is_throttled(e):
+                download_limiter.throttled()
+            elif status is not None and 400 <= status < 500:
+                # Missing months and the like will not fix themselves
+                return None
 
-def upload_to_gcs(file_path, max_retries=3):
-    blob_name = os.path.basename(file_path)
+        if attempt + 1 < max_retries:
+            time.sleep(backoff_delay(attempt))
+
+    return None
+
+
+def upload_to_gcs(file_path, blob_name=None, max_retries=3):
+    blob_name = blob_name or os.path.basename(file_path)
     blob = bucket.blob(blob_name)
     blob.chunk_size = CHUNK_SIZE
+    checksums = file_checksums(file_path)
 
     for attempt in range(max_retries):
         try:
             print(f"Uploading {file_path} to {BUCKET_NAME} (Attempt {attempt + 1})...")
-            blob.upload_from_filename(file_path)
+            with upload_limiter.slot():
+                start = time.perf_counter()
+                with metrics.stage(metrics_unit(file_path), "upload"):
+                    blob.upload_from_filename(file_path)
+                upload_limiter.success(time.perf_counter() - start, checksums["size"])
             print(f"Uploaded: gs://{BUCKET_NAME}/{blob_name}")
 
-            if storage.Blob(bucket=bucket, name=blob_name).exists(storage_client):
+            # The upload response carries the stored object's size and checksums
+            if same_object(checksums, blob_checksums(blob)):
                 print(f"Verification successful for {blob_name}")
+                manifest.record(blob_name, checksums)
+                listing.record(blob)
                 return True
             else:
                 print(f"Verification failed for {blob_name}, retrying...")
         except Exception as e:
             print(f"Failed to upload {file_path} to GCS: {e}")
-        time.sleep(5)
+            if is_throttled(e):
+                upload_limiter.throttled()
+
+        if attempt + 1 < max_retries:
+            time.sleep(backoff_delay(attempt))
 
     print(f"Giving up on {file_path} after {max_retries} attempts.")
     return False
-def convert_gz_to_parquet(gz_path):
-    """Decompress .csv.gz and convert to .parquet, return the parquet path."""
-    # e.g. green_tripdata_2019-01.csv.gz -> green_tripdata_2019-01
-    base = gz_path.removesuffix(".csv.gz")
-    csv_path = base + ".csv"
-    parquet_path = base + ".parquet"
-
-    print(f"Decompressing {gz_path}...")
-    with gzip.open(gz_path, 'rb') as f_in:
-        with open(csv_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-
-    print(f"Converting {csv_path} to parquet...")
-    pl.read_csv(csv_path, infer_schema_length=None).write_parquet(parquet_path)
-    print(f"Created {parquet_path}")
-
-    os.remove(gz_path)
-    os.remove(csv_path)
-    return parquet_path
-
-
-def process_file(data_type, year, month):
-    """Download csv.gz, convert to parquet, upload to GCS."""
-    parquet_filename = f"{data_type}_tripdata_{year}-{month}.parquet"
-
-    if file_exists_in_gcs(parquet_filename):
-        print(f"Skipping {parquet_filename}, already in GCS.")
-        return parquet_filename
-
-    gz_path = download_file(data_type, year, month)
-    if gz_path:
-        parquet_path = convert_gz_to_parquet(gz_path)
-        if upload_to_gcs(parquet_path):
-            os.remove(parquet_path)
-            return parquet_filename
-    return None
+
+
+def upload_parquet(parquet_path, blob_name):
+    if upload_to_gcs(parquet_path, blob_name):
+        metrics.done(metrics_unit(parquet_path), nbytes=os.path.getsize(parquet_path))
+        os.remove(parquet_path)
+        return True
+    return False
+
+
+def process_files(tasks, convert_workers=CONVERT_WORKERS):
+    """Download csv.gz, convert to parquet, upload to GCS; return the uploaded object names.
+
+    Downloads and uploads run on their own thread pools, sized for each
+    limiter's ceiling while the limiter decides how many requests run; the
+    CPU-bound conversion runs on a process pool so it is not serialised by
+    the GIL.
+    Each finished step hands the file path on to the next stage as soon as
+    it completes.
+    """
+    uploaded = []
+    with (
+        ThreadPoolExecutor(max_workers=download_limiter.maximum) as download_pool,
+        # Spawned, not forked: the I/O pools are mid-request when workers start,
+        # and a fork would copy their threads' locks into the child
+        ProcessPoolExecutor(
+            max_workers=convert_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as convert_pool,
+        ThreadPoolExecutor(max_workers=upload_limiter.maximum) as upload_pool,
+    ):
+        pending = {download_pool.submit(download_file, *task): ("download", task) for task in tasks}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, task = pending.pop(future)
+                data_type, year, month = task
+                if stage == "download":
+                    gz_path = future.result()
+                    if gz_path:
+                        future = convert_pool.submit(convert_gz_to_parquet, gz_path, data_type, PARQUET_LAYOUT)
+                        pending[future] = ("convert", task)
+                elif stage == "convert":
+                    try:
+                        parquet_path, seconds = future.result()
+                    except Exception as e:
+                        print(f"Failed to convert {data_type} {year}-{month}: {e}")
+                        parquet_path = None
+                    else:
+                        metrics.add(f"{data_type}_tripdata_{year}-{month}", "convert", seconds)
+                    if parquet_path:
+                        blob_name = object_name(*task)
+                        pending[upload_pool.submit(upload_parquet, parquet_path, blob_name)] = ("upload", task)
+                    else:
+                        # Conversion only removes the gzip once it succeeds
+                        gz_path = os.path.join(DOWNLOAD_DIR, f"{data_type}_tripdata_{year}-{month}.csv.gz")
+                        if os.path.exists(gz_path):
+                            os.remove(gz_path)
+                elif future.result():
+                    uploaded.append(object_name(*task))
+    return uploaded
 
 
 def create_external_table(data_type):
     """Create one external table per data type, pointing at all parquet files in GCS."""
     table_id = f"{BQ_DATASET}.{data_type}_tripdata"
-    uris = [
-        f"gs://{BUCKET_NAME}/{data_type}_tripdata_{year}-*.parquet" for year in YEARS
-    ]
-
     external_config = bigquery.ExternalConfig("PARQUET")
-    external_config.source_uris = uris
     external_config.autodetect = True
 
+    if LAKE_LAYOUT == "hive":
+        # year/month become partition columns, so filters on them prune whole prefixes
+        table_root = f"gs://{BUCKET_NAME}/service={data_type}"
+        hive_partitioning = bigquery.HivePartitioningOptions()
+        hive_partitioning.mode = "CUSTOM"
+        hive_partitioning.source_uri_prefix = f"{table_root}/{{year:INTEGER}}/{{month:INTEGER}}"
+        external_config.hive_partitioning = hive_partitioning
+        external_config.source_uris = [f"{table_root}/year={year}/*" for year in YEARS]
+    else:
+        external_config.source_uris = [
+            f"gs://{BUCKET_NAME}/{data_type}_tripdata_{year}-*.parquet" for year in YEARS
+        ]
+
     table = bigquery.Table(table_id)
     table.external_data_configuration = external_config
 
@@ -146,6 +238,8 @@ def create_external_table(data_type):
 
 if __name__ == "__main__":
     create_bucket(BUCKET_NAME)
+    # One listing of the bucket decides which parquet files are already in sync
+    manifest.load_listing(listing.load().objects)
 
     tasks = [
         (data_type, year, month)
@@ -154,12 +248,19 @@ if __name__ == "__main__":
         for month in MONTHS
     ]
 
-    # Download, normalize, and upload to GCS
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        gcs_filenames = list(executor.map(lambda args: process_file(*args), tasks))
+    pending = []
+    for task in tasks:
+        parquet_filename = object_name(*task)
+        if not FULL_RESYNC and manifest.is_current(parquet_filename):
+            print(f"Skipping {parquet_filename}, already in GCS.")
+        else:
+            pending.append(task)
 
-    valid_filenames = [f for f in gcs_filenames if f is not None]
-    print(f"\nAll files uploaded. {len(valid_filenames)}/{len(tasks)} succeeded.")
+    # Download, normalize, and upload to GCS
+    uploaded = process_files(pending)
+    succeeded = len(tasks) - len(pending) + len(uploaded)
+    print(f"\nAll files uploaded. {succeeded}/{len(tasks)} succeeded.")
+    metrics.summary()
 
     # Create external tables (one per data type)
     print("\n--- Creating external tables in BigQuery ---")
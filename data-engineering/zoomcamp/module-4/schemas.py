@@ -0,0 +1,96 @@
+"""Explicit, versioned Arrow schemas for the trip files converted to Parquet.
+
+Each data type maps schema versions to a pinned list of columns and types,
+so every month is parsed and written the same way and nothing is inferred.
+When a column is added or retyped, add a new version rather than editing an
+old one; the version a file was written with is stored in its Parquet
+metadata under ``schema_version``.
+"""
+import pyarrow as pa
+
+TIMESTAMP = pa.timestamp("us")
+
+SCHEMAS = {
+    "yellow": {
+        1: pa.schema([
+            ("VendorID", pa.int64()),
+            ("tpep_pickup_datetime", TIMESTAMP),
+            ("tpep_dropoff_datetime", TIMESTAMP),
+            ("passenger_count", pa.int64()),
+            ("trip_distance", pa.float64()),
+            ("RatecodeID", pa.int64()),
+            ("store_and_fwd_flag", pa.string()),
+            ("PULocationID", pa.int64()),
+            ("DOLocationID", pa.int64()),
+            ("payment_type", pa.int64()),
+            ("fare_amount", pa.float64()),
+            ("extra", pa.float64()),
+            ("mta_tax", pa.float64()),
+            ("tip_amount", pa.float64()),
+            ("tolls_amount", pa.float64()),
+            ("improvement_surcharge", pa.float64()),
+            ("total_amount", pa.float64()),
+            ("congestion_surcharge", pa.float64()),
+        ]),
+    },
+    "green": {
+        1: pa.schema([
+            ("VendorID", pa.int64()),
+            ("lpep_pickup_datetime", TIMESTAMP),
+            ("lpep_dropoff_datetime", TIMESTAMP),
+            ("store_and_fwd_flag", pa.string()),
+            ("RatecodeID", pa.int64()),
+            ("PULocationID", pa.int64()),
+            ("DOLocationID", pa.int64()),
+            ("passenger_count", pa.int64()),
+            ("trip_distance", pa.float64()),
+            ("fare_amount", pa.float64()),
+            ("extra", pa.float64()),
+            ("mta_tax", pa.float64()),
+            ("tip_amount", pa.float64()),
+            ("tolls_amount", pa.float64()),
+            ("ehail_fee", pa.float64()),
+            ("improvement_surcharge", pa.float64()),
+            ("total_amount", pa.float64()),
+            ("payment_type", pa.int64()),
+            ("trip_type", pa.int64()),
+            ("congestion_surcharge", pa.float64()),
+        ]),
+    },
+    "fhv": {
+        1: pa.schema([
+            ("dispatching_base_num", pa.string()),
+            ("pickup_datetime", TIMESTAMP),
+            ("dropOff_datetime", TIMESTAMP),
+            ("PUlocationID", pa.int64()),
+            ("DOlocationID", pa.int64()),
+            ("SR_Flag", pa.int64()),
+            ("Affiliated_base_number", pa.string()),
+        ]),
+    },
+}
+
+
+def get_schema(data_type, version=None):
+    """Schema for data_type (latest version by default), tagged with its version."""
+    versions = SCHEMAS[data_type]
+    version = version or max(versions)
+    return versions[version].with_metadata({"schema_version": f"{data_type}/v{version}"})
+
+
+def pickup_column(schema):
+    """The pickup timestamp column (tpep_/lpep_/plain pickup_datetime)."""
+    return next(name for name in schema.names if name.lower().endswith("pickup_datetime"))
+
+
+def read_types(schema):
+    """Column types to parse the CSV with.
+
+    Integer columns are parsed as float64 because some TLC months write them
+    as ``1.0``; casting the batch to ``schema`` afterwards turns them back
+    into int64 and fails on genuinely fractional values.
+    """
+    return {
+        field.name: pa.float64() if pa.types.is_integer(field.type) else field.type
+        for field in schema
+    }
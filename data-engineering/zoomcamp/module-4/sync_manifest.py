@@ -0,0 +1,181 @@
+"""Incremental sync bookkeeping for the GCS loaders.
+
+The manifest is a local JSON file keyed by object name. Each entry records
+what was uploaded (size, and base64 MD5/CRC32C in the encoding GCS reports)
+plus the ETag of the source file it came from. At start-up the loader lists
+the bucket once; an object whose listed size and checksums still match its
+manifest entry is up to date and is skipped without any further request.
+Objects that are missing or changed are uploaded again. A listed object the
+manifest has no entry for (a fresh checkout or another machine) is adopted:
+its listed size and checksums become its entry.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+
+import google_crc32c
+
+READ_SIZE = 1024 * 1024
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode("ascii")
+
+
+class ChecksumReader:
+    """Readable wrapper that hashes bytes as they are read.
+
+    It also tracks the position, so a non-seekable stream such as an HTTP
+    response can be handed to a resumable upload, which calls ``tell()``
+    between chunks.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.crc32c = google_crc32c.Checksum()
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            data = self.raw.read()
+        else:
+            # A short read looks like the end of the stream to the uploader
+            blocks = []
+            remaining = n
+            while remaining:
+                block = self.raw.read(remaining)
+                if not block:
+                    break
+                blocks.append(block)
+                remaining -= len(block)
+            data = b"".join(blocks)
+        self.md5.update(data)
+        self.crc32c.update(data)
+        self.size += len(data)
+        return data
+
+    def tell(self):
+        return self.size
+
+    def checksums(self):
+        return {"size": self.size, "md5": _b64(self.md5.digest()), "crc32c": _b64(self.crc32c.digest())}
+
+
+def file_checksums(path):
+    with open(path, "rb") as f:
+        reader = ChecksumReader(f)
+        while reader.read(READ_SIZE):
+            pass
+    return reader.checksums()
+
+
+def blob_checksums(blob):
+    return {"size": blob.size, "md5": blob.md5_hash, "crc32c": blob.crc32c}
+
+
+def same_object(a, b):
+    """Compare two checksum records; composite objects have no MD5, so CRC32C decides."""
+    if a is None or b is None or a["size"] != b["size"] or a["crc32c"] != b["crc32c"]:
+        return False
+    return a.get("md5") is None or b.get("md5") is None or a["md5"] == b["md5"]
+
+
+class BucketListing:
+    """In-memory view of the objects under one or more bucket prefixes.
+
+    ``load()`` fetches names, sizes, generations and checksums with one
+    listing per prefix (1,000 objects per page), after which existence checks
+    are answered from memory. ``record()`` keeps the view current as uploads
+    complete during the run.
+    """
+
+    def __init__(self, client, bucket_name, prefixes=("",)):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.prefixes = prefixes
+        self.lock = threading.Lock()
+        self.objects = {}
+
+    def load(self):
+        objects = {}
+        for prefix in self.prefixes:
+            blobs = self.client.list_blobs(
+                self.bucket_name,
+                prefix=prefix or None,
+                fields="items(name,size,generation,md5Hash,crc32c),nextPageToken",
+            )
+            for blob in blobs:
+                objects[blob.name] = {**blob_checksums(blob), "generation": blob.generation}
+        with self.lock:
+            self.objects.clear()
+            self.objects.update(objects)
+        return self
+
+    def exists(self, name):
+        return name in self.objects
+
+    def get(self, name):
+        return self.objects.get(name)
+
+    def record(self, blob):
+        """Update the view from a blob whose properties came back with its upload."""
+        with self.lock:
+            self.objects[blob.name] = {**blob_checksums(blob), "generation": blob.generation}
+
+
+class SyncManifest:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.remote = {}
+        self.sources = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def load_listing(self, objects):
+        """Compare against objects (name -> checksums), e.g. a loaded BucketListing's objects."""
+        self.remote = objects
+
+    def is_current(self, name, source_etag=None):
+        """True if the bucket still holds what was last uploaded (and the source has not changed)."""
+        entry = self.entries.get(name)
+        remote = self.remote.get(name)
+        if entry is None and remote is not None:
+            entry = self.adopt(name, remote, source_etag)
+        if entry is None or not same_object(entry, remote):
+            return False
+        if source_etag is not None and entry.get("source_etag") is None:
+            # Adopted without a source check; the current source becomes the baseline
+            entry = self.adopt(name, remote, source_etag)
+        return source_etag is None or entry.get("source_etag") == source_etag
+
+    def adopt(self, name, remote, source_etag=None):
+        """Record a listed object as uploaded, e.g. when the manifest file is new."""
+        checksums = {key: remote[key] for key in ("size", "md5", "crc32c")}
+        with self.lock:
+            self.entries[name] = {**checksums, "source_etag": source_etag}
+            self.save()
+        return self.entries[name]
+
+    def note_source(self, name, source_etag):
+        """Remember the ETag of the download an object is about to be built from."""
+        with self.lock:
+            self.sources[name] = source_etag
+
+    def record(self, name, checksums):
+        with self.lock:
+            self.entries[name] = {**checksums, "source_etag": self.sources.pop(name, None)}
+            self.save()
+
+    def save(self):
+        """Write the entries atomically; call with the lock held."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
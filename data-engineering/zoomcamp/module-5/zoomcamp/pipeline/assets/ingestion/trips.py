@@ -82,10 +82,82 @@ columns:
 import io
 import os
 import json
-from urllib.request import Request, urlopen
+import http.client
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
 
 import pandas as pd
 
+BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+# Months are fetched concurrently; each worker thread keeps its connections alive between months
+FETCH_WORKERS = 6
+MAX_REDIRECTS = 5
+
+_local = threading.local()
+
+
+def _connection(scheme, host):
+    """This thread's keep-alive connection to host, opened on first use."""
+    connections = _local.__dict__.setdefault("connections", {})
+    key = (scheme, host)
+    if key not in connections:
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        connections[key] = cls(host, timeout=60)
+    return connections[key]
+
+
+def fetch(url):
+    """GET url over a pooled connection, following redirects; return the body."""
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            conn = _connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers={"User-Agent": "Mozilla/5.0"})
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection; reconnect once
+                conn.close()
+                if attempt:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+        if resp.status in (301, 302, 303, 307, 308):
+            url = urljoin(url, resp.getheader("Location"))
+            continue
+        if resp.status != 200:
+            raise OSError(f"HTTP {resp.status} {resp.reason}")
+        return body
+    raise OSError(f"Too many redirects for {url}")
+
+
+def fetch_month(taxi_type, month):
+    """One month of trips for taxi_type as a DataFrame, or None if it could not be fetched."""
+    url = f"{BASE_URL}/{taxi_type}_tripdata_{month.year}-{month.month:02d}.parquet"
+
+    print(f"Fetching {url}")
+    try:
+        df = pd.read_parquet(io.BytesIO(fetch(url)))
+    except Exception as e:
+        print(f"Skipping {url}: {e}")
+        return None
+    # Normalize column names: yellow uses tpep_ prefix, green uses lpep_
+    prefix = "tpep" if taxi_type == "yellow" else "lpep"
+    df = df.rename(
+        columns={
+            f"{prefix}_pickup_datetime": "pickup_datetime",
+            f"{prefix}_dropoff_datetime": "dropoff_datetime",
+        }
+    )
+    df["taxi_type"] = taxi_type
+    df["extracted_at"] = pd.Timestamp.utcnow()
+    return df
+
 
 def materialize():
     """
@@ -95,7 +167,6 @@ def materialize():
     - Add a column like `extracted_at` for lineage/debugging (timestamp of extraction).
     - Prefer append-only in ingestion; handle duplicates in staging.
     """
-    dfs = []
     start_date = os.environ["BRUIN_START_DATE"]
     end_date = os.environ["BRUIN_END_DATE"]
     taxi_types = json.loads(os.environ["BRUIN_VARS"]).get("taxi_types", ["yellow"])
@@ -103,32 +174,10 @@ def materialize():
     end = pd.to_datetime(end_date)
     months = pd.date_range(start=start, end=end, freq="MS")
 
-    for taxi_type in taxi_types:
-        for month in months:
-            year = month.year
-            month_str = f"{month.month:02d}"
-            url = f"https://d37ci6vzurychx.cloudfront.net/trip-data/{taxi_type}_tripdata_{year}-{month_str}.parquet"
-
-            print(f"Fetching {url}")
-            try:
-                req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-                with urlopen(req) as resp:
-                    df = pd.read_parquet(io.BytesIO(resp.read()))
-            except Exception as e:
-                print(f"Skipping {url}: {e}")
-                continue
-            # Normalize column names: yellow uses tpep_ prefix, green uses lpep_
-            prefix = "tpep" if taxi_type == "yellow" else "lpep"
-            df = df.rename(
-                columns={
-                    f"{prefix}_pickup_datetime": "pickup_datetime",
-                    f"{prefix}_dropoff_datetime": "dropoff_datetime",
-                }
-            )
-            df["taxi_type"] = taxi_type
-            df["extracted_at"] = pd.Timestamp.utcnow()
-
-            dfs.append(df)
+    tasks = [(taxi_type, month) for taxi_type in taxi_types for month in months]
+    # map() yields results in task order, so the output order does not depend on which fetch finishes first
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        dfs = [df for df in executor.map(lambda task: fetch_month(*task), tasks) if df is not None]
     if not dfs:
         return pd.DataFrame()
     return pd.concat(dfs, ignore_index=True)